@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import math
+import timeit
+import logging
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from sdr_sources import GeneratedProcess, ReplaySource, SyntheticSource
+from measurements_log import read_measurements, get_index_file_path, update_index
+from plot_measurements import get_measurements
+from query_measurements import get_cells, get_frequency_occupancy
+from tune_and_monitor import (
+    Baseline,
+    SweepAccumulator,
+    SweepStream,
+    get_config,
+    get_ignored_frequencies,
+    is_frequency_ignored,
+    detect_emitters,
+    generate_graph,
+    parse_sweep_output
+)
+
+
+# Frequency ranges in MHz, from a single hackrf_sweep row up to the full range of the HackRF.
+SCALES = {
+    '1': (136, 137),
+    '38': (136, 174),
+    '400': (100, 500),
+    '5999': (1, 6000)
+}
+
+# The legacy per-frequency loops take minutes on larger spectra.
+LEGACY_MAX_BINS = 400_000
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark the monitoring pipeline.')
+    parser.add_argument('-c', '--config-file-path', default='136-174-config.json', metavar='FILE', help='Path to the config file with the ignored frequencies.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of timed runs per benchmark.')
+    parser.add_argument('-s', '--scales', default=','.join(SCALES), help='Comma-separated bandwidths in MHz, out of {}.'.format(', '.join(SCALES)))
+    parser.add_argument('-n', '--sweeps', type=int, default=10, help='Number of synthetic sweeps to parse per scale.')
+    parser.add_argument('-w', '--width', type=int, default=2500, help='Bin width in Hz.')
+    parser.add_argument('--replay', metavar='FILE', help='Also parse hackrf_sweep output that was recorded in this file.')
+    parser.add_argument('--save', metavar='FILE', help='Store the results, to compare later runs against.')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results with stored results and exit with 1 on a regression.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Slowdown relative to the stored results that counts as a regression.')
+    args = parser.parse_args()
+    return args
+
+
+def measure(function, repeat):
+    # Returns the fastest time, and the peak memory in MB that a separate run allocates. The memory is traced in its
+    # own run, because tracing slows it down, and per run, because the peak RSS of the process never goes down.
+    seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+    tracemalloc.start()
+    try:
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    finally:
+        tracemalloc.stop()
+    return seconds, peak_memory
+
+
+def get_peak_rss():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def report(results, stage, scale, measurement, number_of_bins=None, number_of_sweeps=None):
+    seconds, peak_memory = measurement
+    line = '{:<30} {:>12} {:10.4f} s'.format(stage, scale, seconds)
+    if number_of_bins is not None:
+        line += ' {:>16,.0f} bins/s'.format(number_of_bins / seconds)
+    if number_of_sweeps is not None:
+        line += ' {:>10,.1f} sweeps/s'.format(number_of_sweeps / seconds)
+    print(line + '  peak {:,.1f} MB'.format(peak_memory))
+    results['{} {}'.format(stage, scale)] = {'seconds': seconds, 'peak_memory': peak_memory}
+
+
+def get_synthetic_spectrum(start, end, width, number_of_emitters, seed=0):
+    random = np.random.default_rng(seed)
+    frequencies = SweepAccumulator(start, end, width).frequencies
+    number_of_bins = len(frequencies)
+    tuned_powers = (-70 + random.normal(0, 1, number_of_bins)).astype(np.float32)
+    monitor_powers = (-70 + random.normal(0, 1, number_of_bins)).astype(np.float32)
+
+    # Every emitter is a few bins wide and well above the noise floor.
+    for center in random.integers(0, number_of_bins - 8, number_of_emitters):
+        monitor_powers[center:center + 8] += 30
+    return frequencies, tuned_powers, monitor_powers
+
+
+def legacy_is_frequency_ignored(frequency, ignored_frequencies):
+    # The linear scan that is_frequency_ignored() did before the interval index.
+    for ignored_frequency in ignored_frequencies:
+        if ignored_frequency['start'] <= frequency <= ignored_frequency['end']:
+            return True
+
+
+def legacy_detect(tuned_frequency_mean, monitor_frequency_mean, sensitivity, ignored_frequencies):
+    # The detection loop from main() before it was vectorized.
+    for frequency in monitor_frequency_mean:
+        if monitor_frequency_mean[frequency] >= tuned_frequency_mean[frequency] + sensitivity:
+            if not legacy_is_frequency_ignored(frequency, ignored_frequencies):
+                max_frequency = frequency
+                max_frequency_offset = monitor_frequency_mean[frequency] - tuned_frequency_mean[frequency]
+                for freq in monitor_frequency_mean:
+                    if not legacy_is_frequency_ignored(freq, ignored_frequencies):
+                        frequency_offset = monitor_frequency_mean[freq] - tuned_frequency_mean[freq]
+                        if frequency_offset > max_frequency_offset:
+                            max_frequency = freq
+                            max_frequency_offset = frequency_offset
+                return max_frequency
+            return frequency
+
+
+def benchmark_parsing(results, scale, output, start, end, width, number_of_sweeps, repeat, binary=False):
+    number_of_bins = SweepAccumulator(start, end, width).number_of_bins
+    measurement = measure(lambda: parse_sweep_output(output, start, end, width), repeat)
+    stage = 'parse_sweep_output (binary)' if binary else 'parse_sweep_output'
+    report(results, stage, scale, measurement, number_of_bins * number_of_sweeps, number_of_sweeps)
+
+
+def check_binary_parsing(start, end, width, number_of_sweeps):
+    # The same sweeps as text and as binary output must give the same spectrum. The text has the powers rounded
+    # to two decimals, so the averages differ by at most half of that.
+    logger = logging.getLogger(__name__)
+    text_output = SyntheticSource(logger, seed=1).read(number_of_sweeps, start, end, width)
+    binary_output = SyntheticSource(logger, seed=1, binary=True).read(number_of_sweeps, start, end, width)
+    text_frequencies, text_powers = parse_sweep_output(text_output, start, end, width)
+    binary_frequencies, binary_powers = parse_sweep_output(binary_output, start, end, width)
+
+    if not np.array_equal(text_frequencies, binary_frequencies) or not np.array_equal(np.isnan(text_powers), np.isnan(binary_powers)):
+        return False
+    return np.nanmax(np.abs(text_powers - binary_powers)) <= 0.005 + 1e-4
+
+
+def check_binary_streaming(start, end, width, number_of_sweeps, chunk_size=4093):
+    # The same for SweepStream, which reads the binary output into a buffer and carries a partly read record over
+    # to the next read. Like a pipe, the binary output arrives in pieces that split the records. The rows are read
+    # in this thread, so that both streams get the same sweeps.
+    logger = logging.getLogger(__name__)
+    spectra = list()
+    for binary in (False, True):
+        source = SyntheticSource(logger, seed=1, binary=binary)
+        stream = SweepStream(source, [{'start': start, 'end': end, 'width': width}], logger)
+        lines = (line for sweep in source.get_sweeps([(start, end)], width, number_of_sweeps) for line in sweep)
+        if binary:
+            lines = (line[offset:offset + chunk_size] for line in lines for offset in range(0, len(line), chunk_size))
+        process = GeneratedProcess(lines, binary)
+        if binary:
+            stream._read_records(process)
+        else:
+            stream._read_stdout(process)
+        if stream.accumulator.number_of_sweeps != number_of_sweeps:
+            return False
+        spectra.append(stream.accumulator.get_spectrum()[1])
+
+    text_powers, binary_powers = spectra
+    if not np.array_equal(np.isnan(text_powers), np.isnan(binary_powers)):
+        return False
+    return np.nanmax(np.abs(text_powers - binary_powers)) <= 0.005 + 1e-4
+
+
+def benchmark_baseline(results, scale, start, end, width, repeat):
+    frequencies, tuned_powers, monitor_powers = get_synthetic_spectrum(start, end, width, number_of_emitters=20)
+    baseline = Baseline([{'start': start, 'end': end, 'width': width}], 0.05)
+    baseline.set(0, tuned_powers)
+
+    def difference_and_update():
+        offsets = monitor_powers - baseline.powers[0]
+        baseline.update(0, monitor_powers, 10)
+        return offsets
+
+    report(results, 'baseline', scale, measure(difference_and_update, repeat), len(frequencies))
+
+
+def benchmark_detection(results, scale, start, end, width, ignored_frequencies, ignored_frequency_list, repeat):
+    frequencies, tuned_powers, monitor_powers = get_synthetic_spectrum(start, end, width, number_of_emitters=20)
+    measurement = measure(lambda: detect_emitters(tuned_powers, monitor_powers, 10, ignored_frequencies.mask(frequencies)), repeat)
+    report(results, 'detect_emitters', scale, measurement, len(frequencies))
+
+    if len(frequencies) <= LEGACY_MAX_BINS:
+        tuned_frequency_mean = dict(zip(frequencies.tolist(), tuned_powers.tolist()))
+        monitor_frequency_mean = dict(zip(frequencies.tolist(), monitor_powers.tolist()))
+        measurement = measure(lambda: legacy_detect(tuned_frequency_mean, monitor_frequency_mean, 10, ignored_frequency_list), repeat)
+        report(results, 'detect (legacy)', scale, measurement, len(frequencies))
+
+
+def benchmark_ignored_frequencies(results, scale, start, end, width, ignored_frequencies, ignored_frequency_list, repeat):
+    frequencies = SweepAccumulator(start, end, width).frequencies
+    report(results, 'ignored mask', scale, measure(lambda: ignored_frequencies.mask(frequencies), repeat), len(frequencies))
+
+    if len(frequencies) <= LEGACY_MAX_BINS:
+        frequency_list = frequencies.tolist()
+        measurement = measure(lambda: [is_frequency_ignored(frequency, ignored_frequencies) for frequency in frequency_list], repeat)
+        report(results, 'is_frequency_ignored', scale, measurement, len(frequencies))
+        measurement = measure(lambda: [legacy_is_frequency_ignored(frequency, ignored_frequency_list) for frequency in frequency_list], repeat)
+        report(results, 'is_frequency_ignored (legacy)', scale, measurement, len(frequencies))
+
+
+def benchmark_graph(results, scale, start, end, width, ignored_frequencies, dir_path, repeat):
+    frequencies, tuned_powers, monitor_powers = get_synthetic_spectrum(start, end, width, number_of_emitters=20)
+    frequency = int(frequencies[np.argmax(monitor_powers - tuned_powers)])
+    file_path = os.path.join(dir_path, 'graph-{}.pdf'.format(scale))
+    measurement = measure(
+        lambda: generate_graph(file_path, start, end, frequencies, tuned_powers, monitor_powers, frequency, ignored_frequencies),
+        repeat
+    )
+    report(results, 'generate_graph', scale, measurement, len(frequencies))
+
+
+def benchmark_measurements(results, dir_path, repeat):
+    random = np.random.default_rng(0)
+    for number_of_rows in (1_000, 10_000, 100_000):
+        measurements_file_path = os.path.join(dir_path, 'measurements-{}.csv'.format(number_of_rows))
+        timestamps = 1_700_000_000 + np.sort(random.integers(0, 24 * 60 * 60, number_of_rows))
+        frequencies = random.integers(136_000, 174_000, number_of_rows) * 1000
+        with open(measurements_file_path, 'w') as file:
+            for timestamp, frequency in zip(timestamps.tolist(), frequencies.tolist()):
+                file.write('{},00:00:00,{},{}\n'.format(timestamp, frequency, int(frequency % 7 == 0)))
+
+        scale = '{} rows'.format(number_of_rows)
+        report(results, 'get_measurements', scale, measure(lambda: get_measurements(measurements_file_path), repeat))
+        report(results, 'read_measurements', scale, measure(lambda: read_measurements(measurements_file_path), repeat))
+
+        index_file_path = get_index_file_path(measurements_file_path)
+
+        def build_index():
+            if os.path.isfile(index_file_path):
+                os.remove(index_file_path)
+            update_index(measurements_file_path)
+        report(results, 'update_index', scale, measure(build_index, repeat))
+        report(results, 'query_index', scale, measure(lambda: get_frequency_occupancy(get_cells([measurements_file_path], low=150, high=151)), repeat))
+
+
+def compare(results, file_path, tolerance, min_memory=1.0):
+    # Both the time and the peak memory of a stage count. Peaks below min_memory MB are too small to compare.
+    with open(file_path) as file:
+        stored_results = json.loads(file.read())
+
+    print('\nCompared with {}:'.format(file_path))
+    number_of_regressions = 0
+    for name, result in results.items():
+        if name not in stored_results:
+            continue
+        stored_result = stored_results[name]
+        time_ratio = result['seconds'] / stored_result['seconds']
+        memory_ratio = result['peak_memory'] / max(stored_result['peak_memory'], min_memory)
+        regression = time_ratio > 1 + tolerance or (result['peak_memory'] >= min_memory and memory_ratio > 1 + tolerance)
+        number_of_regressions += regression
+        print('{:<43} {:8.2f}x time {:8.2f}x memory{}'.format(name, time_ratio, memory_ratio, '  REGRESSION' if regression else ''))
+    return number_of_regressions
+
+
+def main():
+    args = get_args()
+    logger = logging.getLogger(__name__)
+    ignored_frequencies = get_ignored_frequencies(args.config_file_path)
+    # The legacy functions scan the ignored frequencies as they are listed in the config.
+    ignored_frequency_list = get_config(args.config_file_path).get('ignored_frequencies', [])
+
+    if not check_binary_parsing(136, 174, args.width, 5):
+        print('The binary and the text output of hackrf_sweep give different spectra.')
+        sys.exit(1)
+    if not all(check_binary_streaming(start, end, args.width, 5) for start, end in (SCALES['38'], SCALES['400'])):
+        print('The binary and the text output of hackrf_sweep give different spectra when streamed.')
+        sys.exit(1)
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as dir_path:
+        source = SyntheticSource(logger, seed=0)
+        binary_source = SyntheticSource(logger, seed=0, binary=True)
+        for scale in args.scales.split(','):
+            start, end = SCALES[scale]
+            output = source.read(args.sweeps, start, end, args.width)
+            benchmark_parsing(results, scale, output, start, end, args.width, args.sweeps, args.repeat)
+            output = binary_source.read(args.sweeps, start, end, args.width)
+            benchmark_parsing(results, scale, output, start, end, args.width, args.sweeps, args.repeat, binary=True)
+            del output
+
+            benchmark_baseline(results, scale, start, end, args.width, args.repeat)
+            benchmark_detection(results, scale, start, end, args.width, ignored_frequencies, ignored_frequency_list, args.repeat)
+            benchmark_ignored_frequencies(results, scale, start, end, args.width, ignored_frequencies, ignored_frequency_list, args.repeat)
+            benchmark_graph(results, scale, start, end, args.width, ignored_frequencies, dir_path, args.repeat)
+
+        if args.replay:
+            # The range is taken from the recorded rows.
+            replay_source = ReplaySource(args.replay, logger, speed=0)
+            rows = [line.split(',', 4) for sweep in replay_source.sweeps for line in sweep]
+            start = min(int(row[2]) for row in rows) // 1_000_000
+            end = int(math.ceil(max(int(row[3]) for row in rows) / 1_000_000))
+            number_of_sweeps = len(replay_source.sweeps)
+            output = replay_source.read(number_of_sweeps, start, end, args.width)
+            benchmark_parsing(results, 'replay', output, start, end, args.width, number_of_sweeps, args.repeat)
+
+        benchmark_measurements(results, dir_path, args.repeat)
+
+    print('Peak RSS of the benchmark {:,.1f} MB'.format(get_peak_rss()))
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            file.write(json.dumps(results, indent=4))
+        print('Stored the results in {}'.format(args.save))
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import json
+import time
+import struct
+import argparse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory, resource_tracker
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+
+# The shared memory starts with a header of int64 values: the number of published spectra, the number of slots and
+# the number of bins. The bin frequencies, the timestamp and sequence number of every slot, and the slots follow.
+HEADER_SIZE = 3 * 8
+
+
+def get_layout(number_of_slots, number_of_bins):
+    frequencies_offset = HEADER_SIZE
+    timestamps_offset = frequencies_offset + 8 * number_of_bins
+    sequences_offset = timestamps_offset + 8 * number_of_slots
+    powers_offset = sequences_offset + 8 * number_of_slots
+    size = powers_offset + 4 * number_of_slots * number_of_bins
+    return frequencies_offset, timestamps_offset, sequences_offset, powers_offset, size
+
+
+class SpectrumRingBuffer:
+    def __init__(self, shared_memory_block, owner):
+        self.shared_memory = shared_memory_block
+        self.owner = owner
+        buffer = self.shared_memory.buf
+        self.header = np.ndarray(3, dtype=np.int64, buffer=buffer)
+        self.number_of_slots = int(self.header[1])
+        self.number_of_bins = int(self.header[2])
+
+        frequencies_offset, timestamps_offset, sequences_offset, powers_offset, _ = get_layout(self.number_of_slots, self.number_of_bins)
+        self.frequencies = np.ndarray(self.number_of_bins, dtype=np.int64, buffer=buffer, offset=frequencies_offset)
+        self.timestamps = np.ndarray(self.number_of_slots, dtype=np.float64, buffer=buffer, offset=timestamps_offset)
+        self.sequences = np.ndarray(self.number_of_slots, dtype=np.int64, buffer=buffer, offset=sequences_offset)
+        self.powers = np.ndarray((self.number_of_slots, self.number_of_bins), dtype=np.float32, buffer=buffer, offset=powers_offset)
+
+    @classmethod
+    def create(cls, name, frequencies, number_of_slots):
+        # A block that was left behind by a previous run is replaced.
+        try:
+            stale_shared_memory = shared_memory.SharedMemory(name)
+            stale_shared_memory.close()
+            stale_shared_memory.unlink()
+        except FileNotFoundError:
+            pass
+
+        number_of_bins = len(frequencies)
+        size = get_layout(number_of_slots, number_of_bins)[-1]
+        shared_memory_block = shared_memory.SharedMemory(name, create=True, size=size)
+        np.ndarray(3, dtype=np.int64, buffer=shared_memory_block.buf)[:] = (0, number_of_slots, number_of_bins)
+        ring_buffer = cls(shared_memory_block, owner=True)
+        ring_buffer.frequencies[:] = frequencies
+        return ring_buffer
+
+    @classmethod
+    def attach(cls, name):
+        shared_memory_block = shared_memory.SharedMemory(name)
+        # Readers must not remove the block when they exit, only the monitor that created it does.
+        resource_tracker.unregister(shared_memory_block._name, 'shared_memory')
+        return cls(shared_memory_block, owner=False)
+
+    @property
+    def number_of_spectra(self):
+        return int(self.header[0])
+
+    def publish(self, timestamp, powers):
+        # The sequence number of a slot is odd while the slot is written. Readers never block the writer.
+        slot = self.number_of_spectra % self.number_of_slots
+        self.sequences[slot] += 1
+        self.powers[slot] = powers
+        self.timestamps[slot] = timestamp
+        self.sequences[slot] += 1
+        self.header[0] += 1
+
+    def read_slot(self, slot):
+        # Returns a copy of the timestamp and powers of a slot. The copy is retried if the slot was written meanwhile.
+        while True:
+            sequence = int(self.sequences[slot])
+            if sequence % 2 == 0:
+                timestamp = float(self.timestamps[slot])
+                powers = self.powers[slot].copy()
+                if int(self.sequences[slot]) == sequence:
+                    return timestamp, powers
+            time.sleep(0)
+
+    def get_slots(self, number_of_spectra):
+        # The slots of the latest spectra, oldest first.
+        number_of_spectra = min(number_of_spectra, self.number_of_spectra, self.number_of_slots - 1)
+        return [(self.number_of_spectra - number_of_spectra + i) % self.number_of_slots for i in range(number_of_spectra)]
+
+    def close(self):
+        del self.header, self.frequencies, self.timestamps, self.sequences, self.powers
+        self.shared_memory.close()
+        if self.owner:
+            self.shared_memory.unlink()
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Serve the live spectrum of the monitor over HTTP.')
+    parser.add_argument('-n', '--name', default='tune_and_monitor', help='Name of the shared memory block, "live_spectrum_name" in the config.')
+    parser.add_argument('-a', '--address', default='127.0.0.1', help='Address to listen on.')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Port to listen on.')
+    args = parser.parse_args()
+    return args
+
+
+class LiveSpectrumHandler(BaseHTTPRequestHandler):
+    # GET /             JSON description of the spectrum.
+    # GET /frequencies  int64 bin frequencies.
+    # GET /spectrum     float32 powers of the latest spectrum.
+    # GET /waterfall    float32 powers of the latest ?rows= spectra, oldest first.
+    # GET /stream       Every new spectrum as a float64 timestamp followed by its float32 powers, until disconnected.
+    shared_memory_name = None
+
+    def send_data(self, views, content_type='application/octet-stream', headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(sum(view.nbytes for view in views)))
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.end_headers()
+        for view in views:
+            self.wfile.write(view)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            ring_buffer = SpectrumRingBuffer.attach(self.shared_memory_name)
+        except FileNotFoundError:
+            self.send_error(503, 'The monitor is not publishing a spectrum.')
+            return
+
+        try:
+            slots = ring_buffer.get_slots(1)
+            if url.path == '/':
+                description = {
+                    'number_of_bins': ring_buffer.number_of_bins,
+                    'number_of_slots': ring_buffer.number_of_slots,
+                    'number_of_spectra': ring_buffer.number_of_spectra,
+                    'start': int(ring_buffer.frequencies[0]),
+                    'end': int(ring_buffer.frequencies[-1]),
+                    'timestamp': ring_buffer.read_slot(slots[0])[0] if slots else None
+                }
+                self.send_data([memoryview(json.dumps(description).encode())], 'application/json')
+            elif url.path == '/frequencies':
+                # The frequencies never change, so they are sent straight from the shared memory.
+                self.send_data([memoryview(ring_buffer.frequencies)])
+            elif url.path == '/spectrum':
+                if not slots:
+                    self.send_error(503, 'No spectrum has been published yet.')
+                    return
+                timestamp, powers = ring_buffer.read_slot(slots[0])
+                self.send_data([memoryview(powers)], headers={'X-Timestamp': str(timestamp)})
+            elif url.path == '/waterfall':
+                rows = parse_qs(url.query).get('rows', ['100'])[0]
+                if not rows.isdecimal() or not int(rows):
+                    self.send_error(400, 'rows must be a positive integer.')
+                    return
+                rows = int(rows)
+                # Every row is copied first, so that a slow client never gets a row that is written while it is sent.
+                spectra = [ring_buffer.read_slot(slot) for slot in ring_buffer.get_slots(rows)]
+                timestamps = ','.join(str(timestamp) for timestamp, _ in spectra)
+                self.send_data([memoryview(powers) for _, powers in spectra], headers={'X-Timestamps': timestamps})
+            elif url.path == '/stream':
+                self.stream(ring_buffer)
+            else:
+                self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            # The dashboard disconnected.
+            pass
+        finally:
+            ring_buffer.close()
+
+    def stream(self, ring_buffer):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('X-Number-Of-Bins', str(ring_buffer.number_of_bins))
+        self.end_headers()
+
+        number_of_spectra = ring_buffer.number_of_spectra
+        while True:
+            if ring_buffer.number_of_spectra == number_of_spectra:
+                time.sleep(0.05)
+                continue
+
+            # A reader that falls behind skips to the latest spectrum.
+            number_of_spectra = ring_buffer.number_of_spectra
+            timestamp, powers = ring_buffer.read_slot(ring_buffer.get_slots(1)[0])
+            self.wfile.write(struct.pack('<d', timestamp))
+            self.wfile.write(memoryview(powers))
+            self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    args = get_args()
+    LiveSpectrumHandler.shared_memory_name = args.name
+    server = ThreadingHTTPServer((args.address, args.port), LiveSpectrumHandler)
+    server.daemon_threads = True
+    print('Serving the live spectrum "{}" on http://{}:{}/'.format(args.name, args.address, args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import io
+import os
+import json
+import time
+
+import numpy as np
+
+
+# An index starts with a fixed-size JSON header, followed by one cell per frequency and hour with measurements.
+INDEX_HEADER_SIZE = 256
+
+INDEX_CELL_DTYPE = np.dtype([
+    ('frequency', '<i8'),
+    ('hour', '<i8'),
+    ('count', '<u4'),
+    ('ignored_count', '<u4'),
+    ('first_timestamp', '<i8'),
+    ('last_timestamp', '<i8')
+])
+
+
+def get_measurements_file_path(graphs_dir_path, timestamp):
+    return os.path.join(graphs_dir_path, timestamp.strftime('%y_%m_%d'), 'measurements.csv')
+
+
+def get_index_file_path(measurements_file_path):
+    return os.path.splitext(measurements_file_path)[0] + '.index'
+
+
+class MeasurementsLog:
+    def __init__(self, graphs_dir_path, flush_interval=5):
+        self.graphs_dir_path = graphs_dir_path
+        self.flush_interval = flush_interval
+        self.file = None
+        self.file_path = None
+        self.lines = list()
+        self.last_flush = time.time()
+
+    def write(self, timestamp, frequency, ignored, extra_columns=()):
+        # Measurements go to the file of the day they were taken, so the log rotates at midnight. Extra columns come
+        # after the first four, which are all that read_measurements() reads.
+        file_path = get_measurements_file_path(self.graphs_dir_path, timestamp)
+        if file_path != self.file_path:
+            self.close()
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            self.file = open(file_path, 'a')
+            self.file_path = file_path
+
+        self.lines.append(','.join(map(str, (
+            int(timestamp.timestamp()),
+            timestamp.strftime('%H:%M:%S'),
+            frequency,
+            int(ignored)
+        ) + tuple(extra_columns))) + '\n')
+        self.poll()
+
+    def poll(self):
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.file.write(''.join(self.lines))
+            self.file.flush()
+            self.lines.clear()
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            # The index of a day is brought up to date when the log moves on to the next day.
+            update_index(self.file_path)
+        self.file = None
+        self.file_path = None
+
+
+def get_empty_measurements():
+    return {
+        'timestamp': np.zeros(0, dtype=np.int64),
+        'frequency': np.zeros(0, dtype=np.int64),
+        'ignored': np.zeros(0, dtype=bool)
+    }
+
+
+def read_measurements(measurements_file_path, offset=0):
+    # Returns the measurements after the byte offset as NumPy columns, and the offset to continue from.
+    with open(measurements_file_path, 'rb') as file:
+        file.seek(offset)
+        data = file.read()
+
+    # A line that is still being written is left for the next read.
+    data = data[:data.rfind(b'\n') + 1]
+    if not data.strip():
+        return get_empty_measurements(), offset + len(data)
+
+    values = np.loadtxt(io.BytesIO(data), delimiter=',', usecols=(0, 2, 3), dtype=np.float64, ndmin=2)
+    measurements = {
+        'timestamp': np.floor(values[:, 0]).astype(np.int64),
+        'frequency': values[:, 1].astype(np.int64),
+        'ignored': values[:, 2].astype(bool)
+    }
+    return measurements, offset + len(data)
+
+
+class MeasurementsReader:
+    def __init__(self, measurements_file_path):
+        self.measurements_file_path = measurements_file_path
+        self.offset = 0
+        self.measurements = get_empty_measurements()
+
+    def update(self):
+        # Only the lines appended since the last update are parsed. Returns the new measurements.
+        if not os.path.isfile(self.measurements_file_path):
+            return get_empty_measurements()
+        if os.path.getsize(self.measurements_file_path) < self.offset:
+            self.offset = 0
+            self.measurements = get_empty_measurements()
+
+        new_measurements, self.offset = read_measurements(self.measurements_file_path, self.offset)
+        if len(new_measurements['timestamp']):
+            for column in self.measurements:
+                self.measurements[column] = np.concatenate((self.measurements[column], new_measurements[column]))
+        return new_measurements
+
+
+def merge_cells(cells):
+    # Sums the cells of the same frequency and hour. The cells are returned sorted by frequency and hour.
+    if not len(cells):
+        return cells
+    cells = cells[np.lexsort((cells['hour'], cells['frequency']))]
+    starts = np.flatnonzero((np.diff(cells['frequency'], prepend=-1) != 0) | (np.diff(cells['hour'], prepend=-1) != 0))
+    merged_cells = cells[starts]
+    merged_cells['count'] = np.add.reduceat(cells['count'], starts)
+    merged_cells['ignored_count'] = np.add.reduceat(cells['ignored_count'], starts)
+    merged_cells['first_timestamp'] = np.minimum.reduceat(cells['first_timestamp'], starts)
+    merged_cells['last_timestamp'] = np.maximum.reduceat(cells['last_timestamp'], starts)
+    return merged_cells
+
+
+def get_cells(measurements):
+    cells = np.zeros(len(measurements['timestamp']), dtype=INDEX_CELL_DTYPE)
+    cells['frequency'] = measurements['frequency']
+    cells['hour'] = measurements['timestamp'] // 3600 * 3600
+    cells['count'] = 1
+    cells['ignored_count'] = measurements['ignored']
+    cells['first_timestamp'] = measurements['timestamp']
+    cells['last_timestamp'] = measurements['timestamp']
+    return merge_cells(cells)
+
+
+def read_index(index_file_path):
+    with open(index_file_path, 'rb') as file:
+        header = json.loads(file.read(INDEX_HEADER_SIZE).decode())
+        cells = np.fromfile(file, dtype=INDEX_CELL_DTYPE, count=header['number_of_cells'])
+    if len(cells) != header['number_of_cells']:
+        raise ValueError('The index {} is truncated.'.format(index_file_path))
+    return header, cells
+
+
+def write_index(index_file_path, header, cells):
+    # Written to a temporary file first, so that a query never reads a partial index. The monitor and a query can
+    # update the same index, so each writes its own temporary file.
+    temp_file_path = '{}.{}.tmp'.format(index_file_path, os.getpid())
+    with open(temp_file_path, 'wb') as file:
+        file.write(json.dumps(header).encode().ljust(INDEX_HEADER_SIZE))
+        file.write(cells.tobytes())
+    os.replace(temp_file_path, index_file_path)
+
+
+def update_index(measurements_file_path):
+    # Returns the cells of a measurements file. Only the measurements that were appended since the index was last
+    # updated are read, and the index is rebuilt if the measurements file was replaced.
+    index_file_path = get_index_file_path(measurements_file_path)
+    header = {'offset': 0, 'number_of_cells': 0}
+    cells = np.zeros(0, dtype=INDEX_CELL_DTYPE)
+    if os.path.isfile(index_file_path):
+        try:
+            header, cells = read_index(index_file_path)
+        except ValueError:
+            pass
+
+    size = os.path.getsize(measurements_file_path)
+    if size < header['offset']:
+        header = {'offset': 0, 'number_of_cells': 0}
+        cells = np.zeros(0, dtype=INDEX_CELL_DTYPE)
+    if size == header['offset'] and os.path.isfile(index_file_path):
+        return cells
+
+    measurements, offset = read_measurements(measurements_file_path, header['offset'])
+    cells = merge_cells(np.concatenate((cells, get_cells(measurements))))
+    write_index(index_file_path, {'offset': offset, 'number_of_cells': len(cells)}, cells)
+    return cells
@@ -0,0 +1,223 @@
+import os
+import copy
+import math
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds in seconds, from a parsed row up to a stalled hackrf_sweep.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        # Metrics without labels are exported from the start, so that rates work from the first scrape.
+        self.reset()
+
+    def get_initial_value(self):
+        return 0
+
+    def get_key(self, labels):
+        return tuple(str(labels[label_name]) for label_name in self.label_names)
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.get_key(labels), self.get_initial_value())
+
+    def reset(self):
+        self.values = {(): self.get_initial_value()} if not self.label_names else dict()
+
+    def merge(self, values):
+        # Adds the values of another process. Called with the lock held.
+        for key, value in values.items():
+            self.values[key] = self.values.get(key, 0) + value
+
+    def format_labels(self, key, extra_labels=()):
+        labels = list(zip(self.label_names, key)) + list(extra_labels)
+        if not labels:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, value.replace('"', '\\"')) for name, value in labels) + '}'
+
+    def get_samples(self):
+        with self.lock:
+            return [(self.name + self.format_labels(key), value) for key, value in sorted(self.values.items())]
+
+    def get_text(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} {}'.format(self.name, self.type)]
+        lines.extend('{} {}'.format(name, format_value(value)) for name, value in self.get_samples())
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def merge(self, values):
+        self.values.update(values)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets) + (math.inf,)
+        super().__init__(name, description, label_names)
+
+    def get_initial_value(self):
+        return [[0] * len(self.buckets), 0.0, 0]
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = self.get_initial_value()
+            bucket_counts, _, _ = self.values[key]
+            for bucket_index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    bucket_counts[bucket_index] += 1
+                    break
+            self.values[key][1] += value
+            self.values[key][2] += 1
+
+    def merge(self, values):
+        for key, (bucket_counts, total, count) in values.items():
+            if key not in self.values:
+                self.values[key] = self.get_initial_value()
+            merged_bucket_counts, _, _ = self.values[key]
+            for bucket_index, bucket_count in enumerate(bucket_counts):
+                merged_bucket_counts[bucket_index] += bucket_count
+            self.values[key][1] += total
+            self.values[key][2] += count
+
+    def get_samples(self):
+        samples = list()
+        with self.lock:
+            for key, (bucket_counts, total, count) in sorted(self.values.items()):
+                # Prometheus buckets are cumulative.
+                cumulative_count = 0
+                for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative_count += bucket_count
+                    samples.append((self.name + '_bucket' + self.format_labels(key, [('le', format_value(bucket))]), cumulative_count))
+                samples.append((self.name + '_sum' + self.format_labels(key), total))
+                samples.append((self.name + '_count' + self.format_labels(key), count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = list()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def get_text(self):
+        return ''.join(metric.get_text() for metric in self.metrics)
+
+    def get_values(self):
+        # A copy of all values that can be sent to another process.
+        values = dict()
+        for metric in self.metrics:
+            with metric.lock:
+                values[metric.name] = copy.deepcopy(metric.values)
+        return values
+
+    def set_values(self, process_values):
+        # Replaces the values with the sum of the values of every process. Every gauge is set by one process only.
+        for metric in self.metrics:
+            with metric.lock:
+                metric.reset()
+                for values in process_values:
+                    metric.merge(values.get(metric.name, dict()))
+
+
+REGISTRY = Registry()
+
+SWEEP_SECONDS = REGISTRY.register(Histogram('tune_and_monitor_sweep_seconds', 'Time to read the sweeps of an interval from the source.', ['interval']))
+PARSE_SECONDS = REGISTRY.register(Histogram('tune_and_monitor_parse_seconds', 'Time to parse the sweeps of an interval.', ['interval']))
+DETECTION_SECONDS = REGISTRY.register(Histogram('tune_and_monitor_detection_seconds', 'Time to detect the emitters of an interval.', ['interval']))
+RENDER_SECONDS = REGISTRY.register(Histogram('tune_and_monitor_render_seconds', 'Time to render a graph in a worker process.'))
+KRAKENSDR_UPDATE_SECONDS = REGISTRY.register(Histogram('tune_and_monitor_krakensdr_update_seconds', 'Time to update the center frequency of the KrakenSDR.'))
+GRAPH_QUEUE_DEPTH = REGISTRY.register(Gauge('tune_and_monitor_graph_queue_depth', 'Graphs waiting to be rendered.'))
+GRAPHS_DROPPED = REGISTRY.register(Counter('tune_and_monitor_graphs_dropped_total', 'Graphs dropped because the graph queue was full.'))
+GRAPHS_COALESCED = REGISTRY.register(Counter('tune_and_monitor_graphs_coalesced_total', 'Queued graphs replaced by a newer graph of the same frequency.'))
+CYCLE_SECONDS = REGISTRY.register(Histogram('tune_and_monitor_cycle_seconds', 'Time of a monitor cycle over all intervals.'))
+DETECTIONS = REGISTRY.register(Counter('tune_and_monitor_detections_total', 'Emitters detected above the sensitivity.', ['interval']))
+IGNORED_DETECTIONS = REGISTRY.register(Counter('tune_and_monitor_ignored_detections_total', 'Detected emitters that are on an ignored frequency.', ['interval']))
+EMITTERS = REGISTRY.register(Counter('tune_and_monitor_emitters_total', 'Emitters that ended and were stored.', ['interval']))
+KRAKENSDR_RETUNES = REGISTRY.register(Counter('tune_and_monitor_krakensdr_retunes_total', 'Center frequency changes written to the KrakenSDR config.'))
+HACKRF_RETRIES = REGISTRY.register(Counter('tune_and_monitor_hackrf_retries_total', 'Failed reads from hackrf_sweep that were retried.'))
+DEVICE_SWEEP_RATE = REGISTRY.register(Gauge('tune_and_monitor_device_sweeps_per_second', 'Sweeps per second of a HackRF in the last cycle.', ['device']))
+DEVICE_BIN_RATE = REGISTRY.register(Gauge('tune_and_monitor_device_bins_per_second', 'Bins per second of a HackRF in the last cycle.', ['device']))
+REVISIT_SECONDS = REGISTRY.register(Gauge('tune_and_monitor_revisit_seconds', 'Time between the last two scans of an interval.', ['interval']))
+PIPELINE_QUEUE_DEPTH = REGISTRY.register(Gauge('tune_and_monitor_pipeline_queue_depth', 'Items waiting in a pipeline queue.', ['queue']))
+PIPELINE_PUTS = REGISTRY.register(Counter('tune_and_monitor_pipeline_puts_total', 'Items put in a pipeline queue.', ['queue']))
+PIPELINE_DROPS = REGISTRY.register(Counter('tune_and_monitor_pipeline_drops_total', 'Items dropped because a pipeline queue was full.', ['queue']))
+PIPELINE_BLOCKED_SECONDS = REGISTRY.register(Counter('tune_and_monitor_pipeline_blocked_seconds_total', 'Time the producer of a pipeline queue waited for space.', ['queue']))
+PIPELINE_IDLE_SECONDS = REGISTRY.register(Counter('tune_and_monitor_pipeline_idle_seconds_total', 'Time the consumer of a pipeline queue waited for items.', ['queue']))
+
+
+def get_interval_label(interval):
+    return '{}-{}'.format(interval['start'], interval['end'])
+
+
+def write_metrics(file_path, registry=REGISTRY):
+    # Written to a temporary file first, so that a collector never reads a partial file.
+    temp_file_path = file_path + '.tmp'
+    with open(temp_file_path, 'w') as file:
+        file.write(registry.get_text())
+    os.replace(temp_file_path, file_path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        text = self.registry.get_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(address, port):
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,58 +1,42 @@
 import os
 import sys
-import math
-import json
 
 from datetime import datetime
 from time import sleep
 
+import numpy as np
 import matplotlib.pyplot as plt
 
-from tune_and_monitor import is_frequency_ignored, get_ignored_frequencies
+from matplotlib.colors import to_rgba_array
+
+from tune_and_monitor import get_config, get_ignored_frequencies
+from measurements_log import get_measurements_file_path as get_log_file_path, read_measurements, MeasurementsReader
 
 
 def get_measurements(measurements_file_path):
+    columns, _ = read_measurements(measurements_file_path)
     measurements = []
-    with open(measurements_file_path, encoding='utf-8') as file:
-        for line in file:
-            values = line.split(',')
-            measurements.append({
-                'timestamp': int(math.floor(float(values[0]))),
-                'datetime': values[1],
-                'frequency': int(values[2]),
-                'ignored': int(values[3])
-            })
+    for timestamp, frequency, ignored in zip(columns['timestamp'].tolist(), columns['frequency'].tolist(), columns['ignored'].tolist()):
+        measurements.append({
+            'timestamp': timestamp,
+            'datetime': datetime.fromtimestamp(timestamp).strftime('%H:%M:%S'),
+            'frequency': frequency,
+            'ignored': int(ignored)
+        })
     return measurements
 
 
-def plot_measurements():
-    config_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), sys.argv[1])
-    with open(config_file_path) as file:
-        config = json.loads(file.read())
+def get_measurements_file_path(config_file_path):
+    config = get_config(config_file_path)
     home_dir = os.path.dirname(os.path.abspath(__file__))
     graphs_dir_path = config.get('graphs_dir_path', os.path.join(home_dir, 'graphs'))
-    timestamp = datetime.today()
-    dir_name = timestamp.strftime('%y_%m_%d')
-    dir_path = os.path.join(graphs_dir_path, dir_name)
-    measurements_file_path = os.path.join(dir_path, 'measurements.csv')
-
-    measurements = get_measurements(measurements_file_path)
-
-    min_frequency = min(measurements, key=lambda v: v['frequency'])['frequency']
-    max_frequency = max(measurements, key=lambda v: v['frequency'])['frequency']
-    min_timestamp = min(measurements, key=lambda v: v['timestamp'])['timestamp']
-    max_timestamp = max(measurements, key=lambda v: v['timestamp'])['timestamp']
-
-    plt.cla()
-    plt.clf()
-    plt.close()
+    return get_log_file_path(graphs_dir_path, datetime.today())
 
-    ax = plt.axes()
-    ax.grid(which='major', linestyle='-', linewidth=0.2)
-    ax.grid(which='minor', linestyle='--', alpha=0.3, linewidth=0.2)
 
-    frequency_margin = (max_frequency - min_frequency) * 0.025
-    timestamp_margin = (max_timestamp - min_timestamp) * 0.025
+def set_axes(ax, min_frequency, max_frequency, min_timestamp, max_timestamp):
+    # A single frequency or timestamp still gets a visible range.
+    frequency_margin = max((max_frequency - min_frequency) * 0.025, 100_000)
+    timestamp_margin = max((max_timestamp - min_timestamp) * 0.025, 1)
     ax.set_xlim(min_frequency - frequency_margin, max_frequency + frequency_margin)
     ax.set_ylim(max_timestamp + timestamp_margin, min_timestamp - timestamp_margin)
 
@@ -96,41 +80,99 @@ def plot_measurements():
         return datetime.fromtimestamp(value).strftime('%H:%M:%S')
     ax.yaxis.set_major_formatter(plt.FuncFormatter(format_y_func))
 
-    ignored_frequencies = get_ignored_frequencies(config_file_path)
 
-    plotted_frequencies = []
-    for measurement in measurements:
-        timestamp = measurement['timestamp']
-        frequency = measurement['frequency']
-        ignored = is_frequency_ignored(frequency, ignored_frequencies)
-
-        if ignored:
-            color = 'grey'
+class MeasurementsPlot:
+    def __init__(self, config_file_path):
+        self.config_file_path = config_file_path
+        self.measurements_file_path = None
+
+    def reset(self, measurements_file_path):
+        plt.close('all')
+        self.measurements_file_path = measurements_file_path
+        self.reader = MeasurementsReader(measurements_file_path)
+        self.ignored_frequencies = None
+        self.ignored = np.zeros(0, dtype=bool)
+        self.plotted_frequencies = set()
+        self.links = dict()
+
+        self.figure = plt.figure()
+        self.ax = self.figure.add_subplot()
+        self.ax.grid(which='major', linestyle='-', linewidth=0.2)
+        self.ax.grid(which='minor', linestyle='--', alpha=0.3, linewidth=0.2)
+        self.scatter = self.ax.scatter([], [], s=1, marker='o', linewidths=0)
+
+    def update_links(self, rows):
+        # The PDF backend only supports links on text, so every measurement that is not ignored gets an invisible
+        # text with a link to its graph.
+        measurements = self.reader.measurements
+        for row in rows.tolist():
+            if self.ignored[row]:
+                if row in self.links:
+                    self.links.pop(row).remove()
+            elif row not in self.links:
+                timestamp = int(measurements['timestamp'][row])
+                frequency = int(measurements['frequency'][row])
+                file_name = '{}-{:03d}_{:03d}_{:03d}.pdf'.format(
+                    datetime.fromtimestamp(timestamp).strftime('%H_%M_%S'),
+                    int(frequency / 1_000_000),
+                    int(frequency % 1_000_000 / 1_000),
+                    int(frequency % 1_000)
+                )
+                url = "file:///{}/{}".format('./measurements', file_name)
+                self.links[row] = self.ax.text(frequency, timestamp, 'o', alpha=0, fontsize=3, url=url)
+
+    def update(self):
+        measurements_file_path = get_measurements_file_path(self.config_file_path)
+        if measurements_file_path != self.measurements_file_path:
+            self.reset(measurements_file_path)
+
+        ignored_frequencies = get_ignored_frequencies(self.config_file_path)
+        number_of_rows = len(self.reader.measurements['timestamp'])
+        new_measurements = self.reader.update()
+        if not len(new_measurements['timestamp']) and ignored_frequencies is self.ignored_frequencies:
+            # Nothing was added to the measurements file and the ignored frequencies did not change.
+            return False
+
+        measurements = self.reader.measurements
+        if not len(measurements['timestamp']):
+            return False
+
+        if ignored_frequencies is not self.ignored_frequencies:
+            self.ignored = ignored_frequencies.mask(measurements['frequency'])
+            self.ignored_frequencies = ignored_frequencies
+            changed_rows = np.arange(len(self.ignored))
         else:
-            color = 'red'
-            file_name = '{}-{:03d}_{:03d}_{:03d}.pdf'.format(
-                datetime.fromtimestamp(timestamp).strftime('%H_%M_%S'),
-                int(frequency / 1_000_000),
-                int(frequency % 1_000_000 / 1_000),
-                int(frequency % 1_000)
-            )
-            url = "file:///{}/{}".format('./measurements', file_name)
-            plt.text(frequency, timestamp, 'o', alpha=0, fontsize=3, url=url)
+            self.ignored = np.concatenate((self.ignored, ignored_frequencies.mask(new_measurements['frequency'])))
+            changed_rows = np.arange(number_of_rows, len(self.ignored))
+
+        self.scatter.set_offsets(np.column_stack((measurements['frequency'], measurements['timestamp'])))
+        self.scatter.set_color(np.where(self.ignored[:, np.newaxis], to_rgba_array('grey'), to_rgba_array('red')))
+        self.update_links(changed_rows)
+
+        for frequency in set(new_measurements['frequency'].tolist()) - self.plotted_frequencies:
+            self.ax.axvline(x=frequency, color='grey', linestyle='dashed', linewidth=0.2)
+            self.plotted_frequencies.add(frequency)
 
-        plt.plot(frequency, timestamp, color=color, marker='o', linestyle='dashed', linewidth=1, markersize=0.3)
+        set_axes(
+            self.ax,
+            measurements['frequency'].min(),
+            measurements['frequency'].max(),
+            measurements['timestamp'].min(),
+            measurements['timestamp'].max()
+        )
 
-        if frequency not in plotted_frequencies:
-            plt.axvline(x=frequency, color='grey', linestyle='dashed', linewidth=0.2)
-            plotted_frequencies.append(frequency)
+        output_file_path = os.path.join(os.path.dirname(self.measurements_file_path), 'measurements.pdf')
+        self.figure.savefig(output_file_path)
+        print('Generated PDF file {}'.format(output_file_path))
+        return True
 
-    plt.xticks(rotation=90)
 
-    output_file_path = os.path.join(os.path.dirname(measurements_file_path), 'measurements.pdf')
-    plt.savefig(output_file_path)
-    print('Generated PDF file {}'.format(output_file_path))
+def plot_measurements(config_file_path):
+    return MeasurementsPlot(config_file_path).update()
 
 
 if __name__ == '__main__':
+    measurements_plot = MeasurementsPlot(os.path.join(os.path.dirname(os.path.abspath(__file__)), sys.argv[1]))
     while True:
-        plot_measurements()
+        measurements_plot.update()
         sleep(5)
@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+import argparse
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import matplotlib
+
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+
+from tune_and_monitor import get_config
+from measurements_log import INDEX_CELL_DTYPE, update_index
+
+
+def parse_time(value):
+    for time_format in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('"{}" is not a date like 2024-01-31 or 2024-01-31 18:30.'.format(value))
+
+
+def parse_end_time(value):
+    # A date without a time ends with that day.
+    end = parse_time(value)
+    if ':' not in value:
+        end += timedelta(days=1, microseconds=-1)
+    return end
+
+
+def get_args(home_dir):
+    parser = argparse.ArgumentParser(description='Query the measurements of many days through their indexes.')
+    parser.add_argument('command', choices=('query', 'heatmap', 'index'), help='Print the active frequencies, plot their occupancy, or only update the indexes.')
+    parser.add_argument('-c', '--config-file-path', default=os.path.join(home_dir, 'config.json'), metavar='FILE', help='Path to the config file with the graphs directory.')
+    parser.add_argument('-s', '--start', type=parse_time, help='Start date or time, the first day with measurements by default.')
+    parser.add_argument('-e', '--end', type=parse_end_time, help='End date or time, now by default. A date includes the whole day.')
+    parser.add_argument('--low', type=float, default=0, help='Lowest frequency in MHz.')
+    parser.add_argument('--high', type=float, default=float('inf'), help='Highest frequency in MHz.')
+    parser.add_argument('--include-ignored', action='store_true', help='Also count the measurements on ignored frequencies.')
+    parser.add_argument('-n', '--limit', type=int, default=50, help='Number of frequencies to print, the most active first.')
+    parser.add_argument('-r', '--resolution', type=float, default=100, help='Frequency resolution of the heatmap in kHz.')
+    parser.add_argument('-o', '--output-file-path', default='occupancy.pdf', metavar='FILE', help='Path of the heatmap.')
+    args = parser.parse_args()
+    return args
+
+
+def get_measurements_file_paths(graphs_dir_path, start=None, end=None):
+    # The measurements of every day are in a directory named after it.
+    file_paths = list()
+    for dir_name in sorted(os.listdir(graphs_dir_path)):
+        try:
+            day = datetime.strptime(dir_name, '%y_%m_%d')
+        except ValueError:
+            continue
+        if start is not None and day.date() < start.date():
+            continue
+        if end is not None and day.date() > end.date():
+            continue
+        file_path = os.path.join(graphs_dir_path, dir_name, 'measurements.csv')
+        if os.path.isfile(file_path):
+            file_paths.append(file_path)
+    return file_paths
+
+
+def get_cells(measurements_file_paths, start=None, end=None, low=0, high=float('inf'), include_ignored=False):
+    # Returns the cells in the range from the indexes of the days. The time range is applied to whole hours.
+    cells = np.concatenate([update_index(file_path) for file_path in measurements_file_paths] or [np.zeros(0, dtype=INDEX_CELL_DTYPE)])
+    selected = (cells['frequency'] >= low * 1_000_000) & (cells['frequency'] <= high * 1_000_000)
+    if start is not None:
+        selected &= cells['last_timestamp'] >= start.timestamp()
+    if end is not None:
+        selected &= cells['first_timestamp'] <= end.timestamp()
+    cells = cells[selected]
+    if not include_ignored:
+        cells = cells.copy()
+        cells['count'] -= cells['ignored_count']
+        cells = cells[cells['count'] > 0]
+    return cells
+
+
+def get_frequency_occupancy(cells):
+    # Sums the cells of every frequency, with the number of hours it was active in.
+    if not len(cells):
+        empty = np.zeros(0, dtype=np.int64)
+        return {'frequency': empty, 'count': empty, 'number_of_hours': empty, 'first_timestamp': empty, 'last_timestamp': empty}
+
+    cells = cells[np.argsort(cells['frequency'], kind='stable')]
+    starts = np.flatnonzero(np.diff(cells['frequency'], prepend=-1) != 0)
+    return {
+        'frequency': cells['frequency'][starts],
+        'count': np.add.reduceat(cells['count'].astype(np.int64), starts),
+        'number_of_hours': np.diff(np.append(starts, len(cells))),
+        'first_timestamp': np.minimum.reduceat(cells['first_timestamp'], starts),
+        'last_timestamp': np.maximum.reduceat(cells['last_timestamp'], starts)
+    }
+
+
+def print_occupancy(occupancy, limit):
+    order = np.argsort(-occupancy['count'], kind='stable')[:limit]
+    print('{:>15}  {:>8}  {:>6}  {:<19}  {:<19}'.format('Frequency (Hz)', 'Count', 'Hours', 'First', 'Last'))
+    for row in order.tolist():
+        print('{:>15,}  {:>8}  {:>6}  {:<19}  {:<19}'.format(
+            int(occupancy['frequency'][row]),
+            int(occupancy['count'][row]),
+            int(occupancy['number_of_hours'][row]),
+            datetime.fromtimestamp(occupancy['first_timestamp'][row]).strftime('%Y-%m-%d %H:%M:%S'),
+            datetime.fromtimestamp(occupancy['last_timestamp'][row]).strftime('%Y-%m-%d %H:%M:%S')
+        ))
+
+
+def plot_occupancy(cells, output_file_path, resolution):
+    # Every row of the heatmap is an hour and every column a frequency range of the resolution in kHz.
+    if not len(cells):
+        print('No measurements in the range.')
+        return
+
+    plt.cla()
+    plt.clf()
+    plt.close()
+
+    hours = np.arange(cells['hour'].min(), cells['hour'].max() + 3600, 3600)
+    resolution_hz = resolution * 1000
+    low = cells['frequency'].min() // resolution_hz * resolution_hz
+    frequency_edges = np.arange(low, cells['frequency'].max() + resolution_hz, resolution_hz)
+    counts, _, _ = np.histogram2d(
+        cells['hour'],
+        cells['frequency'],
+        bins=(np.append(hours, hours[-1] + 3600), frequency_edges),
+        weights=cells['count']
+    )
+
+    ax = plt.axes()
+    image = ax.imshow(
+        np.ma.masked_equal(counts, 0),
+        aspect='auto',
+        interpolation='nearest',
+        cmap='viridis',
+        extent=(frequency_edges[0] / 1_000_000, frequency_edges[-1] / 1_000_000, hours[-1] + 3600, hours[0])
+    )
+    plt.colorbar(image).ax.tick_params(labelsize=4)
+    ax.tick_params(axis='both', which='major', labelsize=4)
+
+    def format_y_func(value, tick_number):
+        return datetime.fromtimestamp(value).strftime('%y-%m-%d %H:00')
+    ax.yaxis.set_major_formatter(plt.FuncFormatter(format_y_func))
+
+    plt.title('Measurements per hour and {:g} kHz'.format(resolution))
+    plt.savefig(output_file_path)
+    print('Generated PDF file {}'.format(output_file_path))
+
+
+def main():
+    home_dir = os.path.dirname(os.path.abspath(__file__))
+    args = get_args(home_dir)
+    config = get_config(os.path.join(home_dir, args.config_file_path))
+    graphs_dir_path = config.get('graphs_dir_path', os.path.join(home_dir, 'graphs'))
+    if not os.path.isdir(graphs_dir_path):
+        print('No measurements in {}'.format(graphs_dir_path))
+        sys.exit(1)
+
+    query_start = time.time()
+    measurements_file_paths = get_measurements_file_paths(graphs_dir_path, args.start, args.end)
+    cells = get_cells(measurements_file_paths, args.start, args.end, args.low, args.high, args.include_ignored)
+    query_time = time.time() - query_start
+
+    if args.command == 'query':
+        occupancy = get_frequency_occupancy(cells)
+        print_occupancy(occupancy, args.limit)
+        print('{} frequencies with {} measurements in {} days, in {:.1f} ms'.format(
+            len(occupancy['frequency']),
+            int(occupancy['count'].sum()),
+            len(measurements_file_paths),
+            query_time * 1000
+        ))
+    elif args.command == 'heatmap':
+        plot_occupancy(cells, args.output_file_path, args.resolution)
+    else:
+        print('Updated the indexes of {} days in {:.1f} ms'.format(len(measurements_file_paths), query_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
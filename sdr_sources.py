@@ -0,0 +1,317 @@
+import io
+import time
+import subprocess
+
+from datetime import datetime
+from time import sleep
+
+import numpy as np
+
+import metrics
+
+
+# hackrf_sweep reports every tuning as rows of this width.
+ROW_WIDTH = 5_000_000
+
+
+def get_sweep_record_dtype(record_length):
+    # With -B, hackrf_sweep writes every row as the length of the rest of the record, the lowest and highest
+    # frequency of the row, and the powers of its bins.
+    return np.dtype([
+        ('record_length', '<u4'),
+        ('hz_low', '<u8'),
+        ('hz_high', '<u8'),
+        ('powers', '<f4', ((record_length - 16) // 4,))
+    ])
+
+
+def get_hackrf_sweep_command(ranges, width, lna_gain, vga_gain, rx_amp, bias_tee, number_of_measurements=None, serial_number=None, binary=False):
+    # Every sweep goes through all the (start, end) ranges in MHz, in the given order.
+    command = ['hackrf_sweep']
+    if serial_number is not None:
+        # libhackrf matches the serial number as it is given, so it must not start with a space like the other options.
+        command.extend(['-d', serial_number])
+    if binary:
+        command.append('-B')
+    command.extend([
+        '-l {}'.format(lna_gain),
+        '-g {}'.format(vga_gain),
+        '-a {}'.format(rx_amp),
+        '-p {}'.format(bias_tee)
+    ])
+    if number_of_measurements is not None:
+        command.append('-N {}'.format(number_of_measurements))
+    command.extend('-f {}:{}'.format(start, end) for start, end in ranges)
+    command.append('-w {}'.format(width))
+    return command
+
+
+class GeneratedRawIO(io.RawIOBase):
+    # Turns generated chunks of bytes into a stream, so that it can be read with readinto like a pipe.
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not len(self.chunk):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.chunk = memoryview(chunk)
+        number_of_bytes = min(len(buffer), len(self.chunk))
+        buffer[:number_of_bytes] = self.chunk[:number_of_bytes]
+        self.chunk = self.chunk[number_of_bytes:]
+        return number_of_bytes
+
+
+class GeneratedProcess:
+    # Looks like a subprocess.Popen to SweepStream, for sources that generate their rows in Python. The output is
+    # text lines, or a binary stream of the generated chunks.
+    def __init__(self, lines, binary=False):
+        self.stdout = io.BufferedReader(GeneratedRawIO(self._read(lines))) if binary else self._read(lines)
+        self.stderr = iter(())
+        self.returncode = None
+        self.terminated = False
+
+    def _read(self, lines):
+        for line in lines:
+            if self.terminated:
+                break
+            yield line
+        self.returncode = 0
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+
+    def wait(self):
+        return self.returncode
+
+
+# hackrf_sweep sweeps at most this many ranges.
+MAX_SWEEP_RANGES = 10
+
+
+class HackRFSweepSource:
+    def __init__(self, lna_gain, vga_gain, rx_amp, bias_tee, logger, serial_number=None, binary=False):
+        # With binary output, hackrf_sweep writes the powers as float32 instead of formatting them as text.
+        self.lna_gain = lna_gain
+        self.vga_gain = vga_gain
+        self.rx_amp = rx_amp
+        self.bias_tee = bias_tee
+        self.logger = logger
+        self.serial_number = serial_number
+        self.binary = binary
+
+    def get_command(self, ranges, width, number_of_measurements=None):
+        return get_hackrf_sweep_command(
+            ranges,
+            width,
+            self.lna_gain,
+            self.vga_gain,
+            self.rx_amp,
+            self.bias_tee,
+            number_of_measurements,
+            self.serial_number,
+            self.binary
+        )
+
+    def read(self, number_of_measurements, start, end, width):
+        return self.read_ranges(number_of_measurements, [(start, end)], width)
+
+    def read_ranges(self, number_of_measurements, ranges, width):
+        command = self.get_command(ranges, width, number_of_measurements)
+
+        self.logger.info('Running command "{}"'.format(' '.join(command)))
+        hackrf_sweep_start = time.time()
+        for _ in range(3):
+            try:
+                result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except Exception:
+                self.logger.error('Exception occurred when running command "{}"'.format(command))
+                metrics.HACKRF_RETRIES.inc()
+                sleep(10)
+                continue
+
+            if result.returncode != 0:
+                self.logger.error('Failed to get data from HackRF One.')
+                self.logger.error('\n' + result.stderr.decode().strip())
+                metrics.HACKRF_RETRIES.inc()
+
+                # Wait for 10 seconds and try reading from HackRF One again.
+                sleep(10)
+            else:
+                break
+        self.logger.debug('Reading output from HackRF One')
+        output = result.stdout if self.binary else result.stdout.decode()
+        self.logger.debug('Received output from HackRF One')
+
+        hackrf_sweep_end = time.time()
+        self.logger.debug('hackrf_sweep: {:.2f}'.format(hackrf_sweep_end - hackrf_sweep_start))
+        return output
+
+    def open(self, ranges, width):
+        # Runs until closed, without -N.
+        command = self.get_command(ranges, width)
+        self.logger.info('Running command "{}"'.format(' '.join(command)))
+        if self.binary:
+            return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+
+
+class ReplaySource:
+    def __init__(self, file_path, logger, speed=1.0):
+        # Replays hackrf_sweep output that was recorded with "hackrf_sweep ... > file_path". A speed of 2 replays
+        # twice as fast as recorded and a speed of 0 as fast as possible.
+        self.file_path = file_path
+        self.logger = logger
+        self.speed = speed
+        self.binary = False
+        self.sweeps = list()
+        self.position = 0
+
+        timestamps = list()
+        sweep_hz_low = None
+        with open(file_path) as file:
+            for line in file:
+                fields = line.split(',', 4)
+                if len(fields) < 5:
+                    continue
+                hz_low = int(fields[2])
+                if sweep_hz_low is None:
+                    sweep_hz_low = hz_low
+                if hz_low == sweep_hz_low:
+                    self.sweeps.append(list())
+                    timestamps.append(self.get_timestamp(fields))
+                self.sweeps[-1].append(line)
+
+        if not self.sweeps:
+            raise ValueError('No sweeps found in {}.'.format(file_path))
+
+        # The duration of a sweep is the time until the next one starts. The last one gets the average.
+        durations = [b - a for a, b in zip(timestamps, timestamps[1:])]
+        self.sweep_durations = durations + [sum(durations) / len(durations) if durations else 0.0]
+        self.logger.info('Loaded {} sweeps from {}'.format(len(self.sweeps), file_path))
+
+    @staticmethod
+    def get_timestamp(fields):
+        try:
+            return datetime.strptime('{} {}'.format(fields[0].strip(), fields[1].strip()), '%Y-%m-%d %H:%M:%S.%f').timestamp()
+        except ValueError:
+            return 0.0
+
+    def get_sweeps(self, ranges, number_of_sweeps=None):
+        # Loops over the recording. Only the rows that overlap the requested ranges are returned.
+        ranges_hz = [(start * 1_000_000, end * 1_000_000) for start, end in ranges]
+        number = 0
+        while number_of_sweeps is None or number < number_of_sweeps:
+            sweep = self.sweeps[self.position]
+            if self.speed:
+                sleep(self.sweep_durations[self.position] / self.speed)
+            self.position = (self.position + 1) % len(self.sweeps)
+            number += 1
+            yield [line for line in sweep if self.overlaps(line, ranges_hz)]
+
+    @staticmethod
+    def overlaps(line, ranges_hz):
+        fields = line.split(',', 4)
+        return any(int(fields[3]) > start_hz and int(fields[2]) < end_hz for start_hz, end_hz in ranges_hz)
+
+    def read(self, number_of_measurements, start, end, width):
+        return self.read_ranges(number_of_measurements, [(start, end)], width)
+
+    def read_ranges(self, number_of_measurements, ranges, width):
+        return ''.join(line for sweep in self.get_sweeps(ranges, number_of_measurements) for line in sweep)
+
+    def open(self, ranges, width):
+        return GeneratedProcess(line for sweep in self.get_sweeps(ranges) for line in sweep)
+
+
+class SyntheticSource:
+    def __init__(self, logger, noise_floor=-70.0, noise=1.0, carriers=None, sweep_rate=0, seed=None, binary=False):
+        # Generates hackrf_sweep output with a noise floor and carriers. Every carrier is a dict with a frequency
+        # and a power in dB, and optionally a width in Hz and a period in seconds and a duty cycle to make it bursty.
+        # A sweep rate of 0 generates sweeps as fast as possible.
+        self.logger = logger
+        self.binary = binary
+        self.noise_floor = noise_floor
+        self.noise = noise
+        self.carriers = carriers or list()
+        self.sweep_rate = sweep_rate
+        self.random = np.random.default_rng(seed)
+
+    def get_sweep(self, ranges, width):
+        hz_lows = np.concatenate([np.arange(start * 1_000_000, end * 1_000_000, ROW_WIDTH) for start, end in ranges])
+        number_of_bins = int(ROW_WIDTH / width)
+        frequencies = hz_lows[:, np.newaxis] + width * np.arange(1, number_of_bins + 1) - width / 2
+        powers = self.noise_floor + self.random.normal(0, self.noise, frequencies.shape)
+
+        now = time.time()
+        for carrier in self.carriers:
+            if 'period' in carrier and now % carrier['period'] >= carrier['period'] * carrier.get('duty_cycle', 0.5):
+                continue
+            on = np.abs(frequencies - carrier['frequency']) <= carrier.get('width', width) / 2
+            powers[on] = np.maximum(powers[on], carrier['power'] + self.random.normal(0, self.noise, np.count_nonzero(on)))
+
+        if self.binary:
+            records = np.zeros(len(hz_lows), dtype=get_sweep_record_dtype(16 + 4 * number_of_bins))
+            records['record_length'] = records.dtype.itemsize - 4
+            records['hz_low'] = hz_lows
+            records['hz_high'] = hz_lows + ROW_WIDTH
+            records['powers'] = powers
+            return [records.tobytes()]
+
+        timestamp = datetime.fromtimestamp(now).strftime('%Y-%m-%d, %H:%M:%S.%f')
+        return [
+            '{}, {}, {}, {:.2f}, {}, {}\n'.format(
+                timestamp,
+                hz_low,
+                hz_low + ROW_WIDTH,
+                width,
+                number_of_bins,
+                ', '.join(map('{:.2f}'.format, row))
+            )
+            for hz_low, row in zip(hz_lows.tolist(), powers.tolist())
+        ]
+
+    def get_sweeps(self, ranges, width, number_of_sweeps=None):
+        number = 0
+        while number_of_sweeps is None or number < number_of_sweeps:
+            if self.sweep_rate:
+                sleep(1 / self.sweep_rate)
+            number += 1
+            yield self.get_sweep(ranges, width)
+
+    def read(self, number_of_measurements, start, end, width):
+        return self.read_ranges(number_of_measurements, [(start, end)], width)
+
+    def read_ranges(self, number_of_measurements, ranges, width):
+        output = (line for sweep in self.get_sweeps(ranges, width, number_of_measurements) for line in sweep)
+        return b''.join(output) if self.binary else ''.join(output)
+
+    def open(self, ranges, width):
+        return GeneratedProcess((line for sweep in self.get_sweeps(ranges, width) for line in sweep), self.binary)
+
+
+def get_source(source_config, lna_gain, vga_gain, rx_amp, bias_tee, logger, serial_number=None):
+    source_type = source_config.get('type', 'hackrf')
+    if source_type == 'hackrf':
+        return HackRFSweepSource(lna_gain, vga_gain, rx_amp, bias_tee, logger, serial_number, source_config.get('binary', False))
+    elif source_type == 'replay':
+        return ReplaySource(source_config['file_path'], logger, source_config.get('speed', 1.0))
+    elif source_type == 'synthetic':
+        return SyntheticSource(
+            logger,
+            source_config.get('noise_floor', -70.0),
+            source_config.get('noise', 1.0),
+            source_config.get('carriers', []),
+            source_config.get('sweep_rate', 0),
+            source_config.get('seed'),
+            source_config.get('binary', False)
+        )
+    raise ValueError('Unknown source type "{}".'.format(source_type))
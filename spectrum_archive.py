@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+
+from datetime import datetime
+
+import numpy as np
+import matplotlib
+
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+
+
+# Every file starts with a fixed-size JSON header, followed by fixed-size records.
+HEADER_SIZE = 256
+
+TUNE = 0
+MONITOR = 1
+
+
+def get_record_dtype(number_of_bins):
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('kind', '<u4'),
+        ('powers', '<f4', (number_of_bins,))
+    ])
+
+
+def get_archive_file_path(graphs_dir_path, timestamp, interval):
+    return os.path.join(
+        graphs_dir_path,
+        timestamp.strftime('%y_%m_%d'),
+        'spectra',
+        '{}-{}-{}.spectra'.format(interval['start'], interval['end'], interval['width'])
+    )
+
+
+class SpectrumArchive:
+    def __init__(self, graphs_dir_path, intervals):
+        self.graphs_dir_path = graphs_dir_path
+        self.intervals = intervals
+        self.files = dict()
+
+    def _get_file(self, timestamp, interval_index, number_of_bins):
+        file_path = get_archive_file_path(self.graphs_dir_path, timestamp, self.intervals[interval_index])
+        if file_path in self.files:
+            return self.files[file_path]
+
+        # A new day starts new files, so the files of the previous day can be closed.
+        day_dir_path = os.path.dirname(os.path.dirname(file_path))
+        for open_file_path in [path for path in self.files if os.path.dirname(os.path.dirname(path)) != day_dir_path]:
+            self.files.pop(open_file_path).close()
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        file = open(file_path, 'ab')
+        if file.tell() == 0:
+            interval = self.intervals[interval_index]
+            header = json.dumps({
+                'start': interval['start'],
+                'end': interval['end'],
+                'width': interval['width'],
+                'number_of_bins': number_of_bins
+            }).encode()
+            file.write(header.ljust(HEADER_SIZE))
+        self.files[file_path] = file
+        return file
+
+    def append(self, timestamp, interval_index, kind, powers):
+        record = np.zeros(1, dtype=get_record_dtype(len(powers)))
+        record['timestamp'] = timestamp.timestamp()
+        record['kind'] = kind
+        record['powers'] = powers
+        self._get_file(timestamp, interval_index, len(powers)).write(record.tobytes())
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files.clear()
+
+
+def open_spectra(file_path):
+    # The records are memory-mapped, so only the spectra that are used are read from disk.
+    with open(file_path, 'rb') as file:
+        header = json.loads(file.read(HEADER_SIZE).decode())
+
+    dtype = get_record_dtype(header['number_of_bins'])
+    number_of_records = (os.path.getsize(file_path) - HEADER_SIZE) // dtype.itemsize
+    if not number_of_records:
+        return header, np.zeros(0, dtype=dtype)
+
+    records = np.memmap(file_path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(number_of_records,))
+    return header, records
+
+
+def get_frequencies(header):
+    return (header['start'] * 1_000_000 + header['width'] * np.arange(header['number_of_bins']) + header['width'] / 2).astype(np.int64)
+
+
+def plot_waterfall(file_path, output_file_path, kind=MONITOR, max_rows=2000):
+    header, records = open_spectra(file_path)
+    timestamps = records['timestamp']
+    rows = np.flatnonzero(records['kind'] == kind)
+    # Long recordings are decimated, so only max_rows spectra are read.
+    rows = rows[::max(1, int(np.ceil(len(rows) / max_rows)))]
+    if not len(rows):
+        print('No spectra in {}'.format(file_path))
+        return
+
+    plt.cla()
+    plt.clf()
+    plt.close()
+
+    ax = plt.axes()
+    ax.imshow(
+        records['powers'][rows],
+        aspect='auto',
+        interpolation='nearest',
+        cmap='viridis',
+        vmin=-100,
+        vmax=0,
+        extent=(header['start'], header['end'], timestamps[rows[-1]], timestamps[rows[0]])
+    )
+    ax.tick_params(axis='both', which='major', labelsize=4)
+
+    def format_y_func(value, tick_number):
+        return datetime.fromtimestamp(value).strftime('%H:%M:%S')
+    ax.yaxis.set_major_formatter(plt.FuncFormatter(format_y_func))
+
+    plt.title('{}-{} MHz'.format(header['start'], header['end']))
+    plt.savefig(output_file_path)
+    print('Generated PDF file {}'.format(output_file_path))
+
+
+if __name__ == '__main__':
+    for file_path in sys.argv[1:]:
+        plot_waterfall(file_path, os.path.splitext(file_path)[0] + '-waterfall.pdf')
@@ -1,17 +1,38 @@
-import io
 import os
-import csv
+import sys
 import time
+import math
 import json
+import queue
+import bisect
+import atexit
+import signal
 import logging
+import logging.handlers
 import argparse
-import subprocess
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
+
+import numpy as np
+import matplotlib
+
+# Graphs are rendered without a display, in worker processes.
+matplotlib.use('Agg')
 
 import matplotlib.pyplot as plt
 
 from datetime import datetime
 from time import sleep
 
+import metrics
+import spectrum_archive
+
+from sdr_sources import MAX_SWEEP_RANGES, HackRFSweepSource, get_source, get_sweep_record_dtype
+from live_spectrum import SpectrumRingBuffer
+from measurements_log import MeasurementsLog
+
 
 def get_logger(log_file_path):
     logger = logging.getLogger(__name__)
@@ -39,7 +60,7 @@ def get_args(home_dir):
     return args
 
 
-def generate_graph(file_path, interval_start, interval_end, tuned_frequency_mean, monitor_frequency_mean, frequency, logger, ignored_frequencies):
+def generate_graph(file_path, interval_start, interval_end, frequencies, tuned_powers, monitor_powers, frequency, ignored_frequencies):
     plt.cla()
     plt.clf()
     plt.close()
@@ -79,13 +100,9 @@ def generate_graph(file_path, interval_start, interval_end, tuned_frequency_mean
     ax.xaxis.set_major_formatter(plt.FuncFormatter(format_func))
     ax.xaxis.set_minor_formatter(plt.FuncFormatter(format_func))
 
-    sorted_tuned_frequency_mean_keys = sorted(tuned_frequency_mean)
-    sorted_tuned_frequency_mean_values = [tuned_frequency_mean[f] for f in sorted_tuned_frequency_mean_keys]
-    plt.plot(sorted_tuned_frequency_mean_keys, sorted_tuned_frequency_mean_values, label='Tuned signal', linewidth='0.5')
-    if monitor_frequency_mean:
-        sorted_monitor_frequency_mean_keys = sorted(monitor_frequency_mean)
-        sorted_monitor_frequency_mean_values = [monitor_frequency_mean[f] for f in sorted_tuned_frequency_mean_keys]
-        plt.plot(sorted_monitor_frequency_mean_keys, sorted_monitor_frequency_mean_values, label='Monitored signal', linewidth='0.25')
+    plt.plot(frequencies, tuned_powers, label='Tuned signal', linewidth='0.5')
+    if monitor_powers is not None:
+        plt.plot(frequencies, monitor_powers, label='Monitored signal', linewidth='0.25')
 
     for ignored_frequency in ignored_frequencies:
         plt.axvspan(ignored_frequency['start'], ignored_frequency['end'], color='grey', alpha=0.33)
@@ -94,14 +111,134 @@ def generate_graph(file_path, interval_start, interval_end, tuned_frequency_mean
         plt.axvspan(frequency - 500_000, frequency + 500_000, color='green', alpha=0.2)
         plt.title('Frequency {:.3f} MHz'.format(frequency / 1_000_000))
 
-        monitored_frequency_power = monitor_frequency_mean[frequency]
-        tuned_frequency_power = tuned_frequency_mean[frequency]
+        frequency_index = np.searchsorted(frequencies, frequency)
+        monitored_frequency_power = monitor_powers[frequency_index]
+        tuned_frequency_power = tuned_powers[frequency_index]
         plt.axvline(x=frequency, color='#000000', linestyle='solid', linewidth=0.1)
         plt.axhline(y=monitored_frequency_power, color='#ff00aa', linestyle='solid', linewidth=0.3) # TODO Remove.
         plt.axhline(y=tuned_frequency_power, color='#00ffaa', linestyle='solid', linewidth=0.3) # TODO Remove.
 
     plt.savefig(file_path)
-    logger.warning('Generated file {}'.format(file_path))
+
+
+def ignore_signals():
+    # The child processes are stopped by the main process, which gets the signals.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def render_graph(*args):
+    render_start = time.time()
+    os.makedirs(os.path.dirname(args[0]), exist_ok=True)
+    generate_graph(*args)
+    return time.time() - render_start
+
+
+class GraphRenderer:
+    def __init__(self, logger, number_of_workers=1, queue_size=16, policy='coalesce'):
+        # When the queue is full, new graphs are either dropped or wait for space ('block'). With 'coalesce', a
+        # queued graph of the same frequency is replaced by the newer one, and only new frequencies are dropped.
+        if policy not in ('drop', 'coalesce', 'block'):
+            raise ValueError('Unknown graph queue policy "{}".'.format(policy))
+
+        self.logger = logger
+        self.queue_size = queue_size
+        self.policy = policy
+        self.condition = threading.Condition()
+        self.jobs = collections.OrderedDict()
+        self.number_of_jobs = 0
+        self.number_of_rendered_graphs = 0
+        self.number_of_dropped_graphs = 0
+        self.number_of_coalesced_graphs = 0
+        self.render_times = collections.deque(maxlen=100)
+        self.running = True
+
+        # Spawned workers do not inherit the locks of the threads that read from hackrf_sweep.
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            number_of_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=ignore_signals
+        )
+        self.threads = [threading.Thread(target=self._dispatch, daemon=True) for _ in range(number_of_workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, file_path, interval_start, interval_end, frequencies, tuned_powers, monitor_powers, frequency, ignored_frequencies, key=None):
+        # The arrays are copied, so the caller is free to keep updating its own.
+        args = (
+            file_path,
+            interval_start,
+            interval_end,
+            np.array(frequencies),
+            np.array(tuned_powers),
+            None if monitor_powers is None else np.array(monitor_powers),
+            frequency,
+            ignored_frequencies
+        )
+        with self.condition:
+            self.number_of_jobs += 1
+            if key is None:
+                key = ('job', self.number_of_jobs)
+            elif self.policy == 'coalesce' and key in self.jobs:
+                self.jobs[key] = args
+                self.number_of_coalesced_graphs += 1
+                metrics.GRAPHS_COALESCED.inc()
+                return
+
+            if len(self.jobs) >= self.queue_size:
+                if self.policy == 'block':
+                    self.condition.wait_for(lambda: len(self.jobs) < self.queue_size)
+                else:
+                    self.number_of_dropped_graphs += 1
+                    metrics.GRAPHS_DROPPED.inc()
+                    self.logger.warning('Graph queue is full, dropped file {}'.format(file_path))
+                    return
+
+            self.jobs[key] = args
+            metrics.GRAPH_QUEUE_DEPTH.set(len(self.jobs))
+            self.condition.notify_all()
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.jobs or not self.running)
+                if not self.jobs:
+                    return
+                _, args = self.jobs.popitem(last=False)
+                metrics.GRAPH_QUEUE_DEPTH.set(len(self.jobs))
+                self.condition.notify_all()
+
+            try:
+                render_time = self.executor.submit(render_graph, *args).result()
+            except Exception:
+                self.logger.exception('Failed to generate file {}'.format(args[0]))
+                continue
+
+            with self.condition:
+                self.number_of_rendered_graphs += 1
+                self.render_times.append(render_time)
+            metrics.RENDER_SECONDS.observe(render_time)
+            self.logger.warning('Generated file {}'.format(args[0]))
+
+    def get_metrics(self):
+        with self.condition:
+            return {
+                'queue_depth': len(self.jobs),
+                'rendered': self.number_of_rendered_graphs,
+                'dropped': self.number_of_dropped_graphs,
+                'coalesced': self.number_of_coalesced_graphs,
+                'mean_render_time': sum(self.render_times) / len(self.render_times) if self.render_times else 0.0,
+                'max_render_time': max(self.render_times, default=0.0)
+            }
+
+    def close(self):
+        # Queued graphs are still rendered before the workers exit.
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.executor.shutdown()
 
 
 def get_intervals(included_frequencies):
@@ -141,101 +278,1433 @@ def get_frequencies(included_frequency_start, included_frequency_end, included_f
         )
 
 
+def get_krakensdr_center_frequency(krakensdr_config_file_path):
+    with open(krakensdr_config_file_path, 'r', encoding='utf-8') as file:
+        return float(json.loads(file.read())['center_freq'])
+
+
 def update_krakensdr_center_frequency(frequency, krakensdr_config_file_path):
     with open(krakensdr_config_file_path, 'r', encoding='utf-8') as file:
         krakensdr_config = json.loads(file.read())
 
     if abs(float(krakensdr_config['center_freq']) - float(frequency)) > 0.1:
         krakensdr_config['center_freq'] = frequency
-        with open(krakensdr_config_file_path, 'w', encoding='utf-8') as file:
+        # The KrakenSDR reads the file while it is running, so it must never see a partially written config.
+        temp_file_path = krakensdr_config_file_path + '.tmp'
+        with open(temp_file_path, 'w', encoding='utf-8') as file:
             file.write(json.dumps(krakensdr_config, indent=4))
+        os.replace(temp_file_path, krakensdr_config_file_path)
+        return True
+    return False
+
+
+class KrakenSDRTuner:
+    def __init__(self, settings, logger):
+        # The settings are the live settings of the monitor, so changes to the config apply right away.
+        self.settings = settings
+        self.logger = logger
+        self.krakensdr_config_file_path = None
+        self.center_frequency = None
+        self.priority = -math.inf
+        self.last_retune_time = -math.inf
+        self.pending_retune = None
+
+    def request(self, frequency, priority):
+        # Detections are collected during the dwell time, and only the one with the highest priority is tuned to.
+        if self.pending_retune is None or priority > self.pending_retune[1]:
+            self.pending_retune = (frequency, priority)
+        self.poll()
+
+    def poll(self):
+        if self.pending_retune is None:
+            return
+
+        # A different config file means the center frequency is not known anymore.
+        if self.krakensdr_config_file_path != self.settings['krakensdr_config_file_path']:
+            self.krakensdr_config_file_path = self.settings['krakensdr_config_file_path']
+            self.center_frequency = get_krakensdr_center_frequency(self.krakensdr_config_file_path)
+
+        # Within the dwell time, only an emitter that is stronger by the preemption margin takes the KrakenSDR over.
+        frequency, priority = self.pending_retune
+        dwelling = time.time() - self.last_retune_time < self.settings['krakensdr_min_dwell_time']
+        if dwelling and priority < self.priority + self.settings['krakensdr_preemption_margin']:
+            return
+
+        self.pending_retune = None
+        if abs(self.center_frequency - frequency) <= 0.1:
+            self.priority = priority
+            return
+
+        krakensdr_update_start = time.time()
+        update_krakensdr_center_frequency(frequency, self.krakensdr_config_file_path)
+        metrics.KRAKENSDR_UPDATE_SECONDS.observe(time.time() - krakensdr_update_start)
+        metrics.KRAKENSDR_RETUNES.inc()
+        self.logger.info('Tuned the KrakenSDR to {:.3f} MHz'.format(frequency))
+
+        self.center_frequency = frequency
+        self.priority = priority
+        self.last_retune_time = time.time()
+
+
+class IgnoredFrequencies:
+    def __init__(self, ignored_frequencies):
+        # Keep the ignored frequencies as sorted, non-overlapping intervals so that lookups can bisect.
+        self.starts = list()
+        self.ends = list()
+        for start, end in sorted((f['start'], f['end']) for f in ignored_frequencies):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+        self.starts_array = np.array(self.starts, dtype=np.float64)
+        self.ends_array = np.array(self.ends, dtype=np.float64)
+
+    def __contains__(self, frequency):
+        index = bisect.bisect_right(self.starts, frequency) - 1
+        return index >= 0 and frequency <= self.ends[index]
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            yield {'start': start, 'end': end}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def mask(self, frequencies):
+        frequencies = np.asarray(frequencies)
+        if not self.starts:
+            return np.zeros(frequencies.shape, dtype=bool)
+        indices = np.searchsorted(self.starts_array, frequencies, side='right') - 1
+        return (indices >= 0) & (frequencies <= self.ends_array[np.maximum(indices, 0)])
+
+
+class ConfigCache:
+    def __init__(self, config_file_path):
+        self.config_file_path = config_file_path
+        self.file_id = None
+        self.config = None
+        self.ignored_frequencies = None
+        self.listeners = list()
+
+    def add_listener(self, listener):
+        # Listeners are called with the new config every time the file changes.
+        self.listeners.append(listener)
+
+    def reload(self):
+        try:
+            stat = os.stat(self.config_file_path)
+            file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if file_id == self.file_id:
+                return False
 
+            with open(self.config_file_path) as file:
+                config = json.loads(file.read())
+        except (FileNotFoundError, json.JSONDecodeError):
+            # The file is probably being written, or replaced by an editor. Keep the previous config and try again on
+            # the next call.
+            if self.config is None:
+                raise
+            return False
 
-def get_ignored_frequencies(config_file_path):
-    with open(config_file_path) as file:
-        config = json.loads(file.read())
+        ignored_frequencies = config.get('ignored_frequencies', [])
+        for ignored_frequency in ignored_frequencies:
+            if ('start' not in ignored_frequency or 'end' not in ignored_frequency) and \
+               'center' in ignored_frequency and 'span' in ignored_frequency:
+                ignored_frequency['start'] = ignored_frequency['center'] - ignored_frequency['span']
+                ignored_frequency['end'] = ignored_frequency['center'] + ignored_frequency['span']
 
-    ignored_frequencies = config.get('ignored_frequencies', [])
-    for ignored_frequency in ignored_frequencies:
-        if 'start' not in ignored_frequency or 'end' not in ignored_frequency and \
-           'center' in ignored_frequency and 'span' in ignored_frequency:
-            ignored_frequency['start'] = ignored_frequency['center'] - ignored_frequency['span']
-            ignored_frequency['end'] = ignored_frequency['center'] + ignored_frequency['span']
+        self.file_id = file_id
+        self.config = config
+        self.ignored_frequencies = IgnoredFrequencies(ignored_frequencies)
+        for listener in self.listeners:
+            listener(config)
+        return True
+
+    def get_config(self):
+        self.reload()
+        return self.config
 
-    return ignored_frequencies
+    def get_ignored_frequencies(self):
+        self.reload()
+        return self.ignored_frequencies
+
+
+config_caches = dict()
+
+
+def get_config_cache(config_file_path):
+    config_file_path = os.path.abspath(config_file_path)
+    if config_file_path not in config_caches:
+        config_caches[config_file_path] = ConfigCache(config_file_path)
+    return config_caches[config_file_path]
+
+
+def get_config(config_file_path):
+    return get_config_cache(config_file_path).get_config()
+
+
+def get_ignored_frequencies(config_file_path):
+    return get_config_cache(config_file_path).get_ignored_frequencies()
+
+
+def get_settings(config):
+    # Settings that can change while running, without restarting the process.
+    return {
+        'lna_gain': config.get('lna_gain', 16),
+        'vga_gain': config.get('vga_gain', 16),
+        'rx_amp': config.get('rx_amp', 0),
+        'bias_tee': config.get('bias_tee', 0),
+        'tune_number_of_samples': config.get('tune_number_of_samples', 200),
+        'monitor_number_of_samples': config.get('monitor_number_of_samples', 20),
+        'sensitivity': config.get('sensitivity', 10),
+        'update_krakensdr': config.get('update_krakensdr', False),
+        'integration': config.get('integration', 1),
+        'tuning_period': config.get('tuning_period', 20),
+        'krakensdr_config_file_path': config.get('krakensdr_config_file_path', ''),
+        'krakensdr_min_dwell_time': config.get('krakensdr_min_dwell_time', 5),
+        'krakensdr_preemption_margin': config.get('krakensdr_preemption_margin', 6)
+    }
 
 
 def is_frequency_ignored(frequency, ignored_frequencies):
-    for ignored_frequency in ignored_frequencies:
-        if ignored_frequency['start'] <= frequency <= ignored_frequency['end']:
+    return frequency in ignored_frequencies
+
+
+class SweepAccumulator:
+    def __init__(self, start, end, width):
+        self.start = start
+        self.end = end
+        self.width = width
+
+        # Every bin is stored at its offset from the start of the interval.
+        self.start_hz = start * 1_000_000
+        self.end_hz = end * 1_000_000
+        self.number_of_bins = int(math.ceil((self.end_hz - self.start_hz) / width))
+        self.frequencies = (self.start_hz + width * np.arange(self.number_of_bins) + width / 2).astype(np.int64)
+
+        # Learned from the stream: the first row of every sweep and how many rows a sweep has.
+        self.sweep_hz_low = None
+        self.rows_per_sweep = None
+        self.reset()
+
+    def reset(self):
+        self.measurements_sum = np.zeros(self.number_of_bins, dtype=np.float64)
+        self.measurements_count = np.zeros(self.number_of_bins, dtype=np.int32)
+        self.number_of_sweeps = 0
+        self.rows_in_sweep = 0
+
+    def add_rows(self, hz_lows, values):
+        # Only the first and last bin in range are calculated for every row, the same way as in add_row, and the bins
+        # between them are added to a slice. Rounding moves a bound by at most one bin, which the steps correct.
+        numbers = np.arange(1, values.shape[1] + 1)
+
+        def get_frequencies(indices):
+            return hz_lows + self.width * numbers[np.clip(indices, 0, len(numbers) - 1)] - self.width / 2
+
+        first_indices = np.clip(np.floor((self.start_hz - hz_lows) / self.width + 0.5).astype(np.intp), 0, len(numbers))
+        first_indices -= (first_indices > 0) & (get_frequencies(first_indices - 1) > self.start_hz)
+        first_indices += (first_indices < len(numbers)) & (get_frequencies(first_indices) <= self.start_hz)
+        last_indices = np.clip(np.ceil((self.end_hz - hz_lows) / self.width - 0.5).astype(np.intp), 0, len(numbers))
+        last_indices -= (last_indices > 0) & (get_frequencies(last_indices - 1) >= self.end_hz)
+        last_indices += (last_indices < len(numbers)) & (get_frequencies(last_indices) < self.end_hz)
+
+        first_offsets = ((get_frequencies(first_indices) - self.start_hz) // self.width).astype(np.intp)
+        rows = np.flatnonzero(first_indices < last_indices)
+        for row, first_index, last_index, first_offset in zip(rows.tolist(), first_indices[rows].tolist(), last_indices[rows].tolist(), first_offsets[rows].tolist()):
+            last_offset = first_offset + last_index - first_index
+            self.measurements_sum[first_offset:last_offset] += values[row, first_index:last_index]
+            self.measurements_count[first_offset:last_offset] += 1
+
+    def add_line(self, line):
+        fields = line.split(',', 6)
+        if len(fields) < 7:
+            return
+        self.add_row(int(fields[2]), np.fromstring(fields[6], sep=','))
+
+    def add_row(self, hz_low, values):
+        if self.sweep_hz_low is None:
+            self.sweep_hz_low = hz_low
+        elif hz_low == self.sweep_hz_low and self.rows_in_sweep:
+            # A new sweep started, so the previous one is complete.
+            if self.rows_per_sweep is None:
+                self.rows_per_sweep = self.rows_in_sweep
+                self.number_of_sweeps += 1
+            self.rows_in_sweep = 0
+
+        # The bins of a row are contiguous, so they are added to a slice instead of counting over all bins.
+        frequencies = hz_low + self.width * np.arange(1, len(values) + 1) - self.width / 2
+        in_range = np.flatnonzero((frequencies > self.start_hz) & (frequencies < self.end_hz))
+        if len(in_range):
+            first_index = in_range[0]
+            last_index = in_range[-1] + 1
+            first_offset = int((frequencies[first_index] - self.start_hz) // self.width)
+            last_offset = first_offset + last_index - first_index
+            self.measurements_sum[first_offset:last_offset] += values[first_index:last_index]
+            self.measurements_count[first_offset:last_offset] += 1
+
+        self.rows_in_sweep += 1
+        if self.rows_per_sweep is not None and self.rows_in_sweep == self.rows_per_sweep:
+            self.number_of_sweeps += 1
+            self.rows_in_sweep = 0
+
+    def get_spectrum(self):
+        powers = np.full(self.number_of_bins, np.nan, dtype=np.float32)
+        measured = self.measurements_count > 0
+        powers[measured] = self.measurements_sum[measured] / self.measurements_count[measured]
+        return self.frequencies, powers
+
+    def get_measurements(self):
+        return spectrum_to_dict(*self.get_spectrum())
+
+
+def spectrum_to_dict(frequencies, powers):
+    # Compatibility with callers that expect a {frequency: power} dict of the measured bins.
+    measured = ~np.isnan(powers)
+    return dict(zip(frequencies[measured].tolist(), powers[measured].tolist()))
+
+
+def parse_sweep_output(output, start, end, width):
+    if isinstance(output, bytes):
+        return parse_sweep_records(output, start, end, width)
+
+    accumulator = SweepAccumulator(start, end, width)
+    first_line = output[:output.find('\n')]
+    if not first_line.strip():
+        return accumulator.get_spectrum()
+
+    number_of_columns = first_line.count(',') + 1
+    # A StringIO keeps four bytes per character of the output, the lines only one.
+    data = np.loadtxt(output.splitlines(), delimiter=',', usecols=[2] + list(range(6, number_of_columns)), ndmin=2)
+    accumulator.add_rows(data[:, 0], data[:, 1:])
+    return accumulator.get_spectrum()
+
+
+def parse_sweep_records(output, start, end, width):
+    # Binary output of hackrf_sweep -B. All records of a run have the same length, so the output is used as an
+    # array of records as it is, without copying or converting the powers.
+    accumulator = SweepAccumulator(start, end, width)
+    if len(output) < 4:
+        return accumulator.get_spectrum()
+
+    dtype = get_sweep_record_dtype(int.from_bytes(output[:4], 'little'))
+    records = np.frombuffer(output, dtype=dtype, count=len(output) // dtype.itemsize)
+    accumulator.add_rows(records['hz_low'].astype(np.float64), records['powers'])
+    return accumulator.get_spectrum()
+
+
+class SweepStream:
+    def __init__(self, source, intervals, logger):
+        # One hackrf_sweep sweeps all the intervals, which have the same bin width, so that a device is opened once.
+        # Every row is added to the intervals it overlaps.
+        self.source = source
+        self.intervals = intervals
+        self.width = intervals[0]['width']
+        self.logger = logger
+        self.accumulators = [SweepAccumulator(i['start'], i['end'], i['width']) for i in intervals]
+        # Every accumulator gets every row, so the first one counts the sweeps of all of them.
+        self.accumulator = self.accumulators[0]
+        self.condition = threading.Condition()
+        self.process = None
+        self.stderr_lines = collections.deque(maxlen=20)
+        # Time spent parsing the rows of the current reading.
+        self.parse_time = 0.0
+        # Rows are dropped until the next sweep starts, so that a reading never contains a partial sweep.
+        self.waiting_for_sweep_start = True
+
+    def open(self):
+        self.process = self.source.open([(interval['start'], interval['end']) for interval in self.intervals], self.width)
+        self.stderr_lines.clear()
+        read_stdout = self._read_records if self.source.binary else self._read_stdout
+        threading.Thread(target=read_stdout, args=(self.process,), daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(self.process,), daemon=True).start()
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.process = None
+
+    def add_row(self, hz_low, values):
+        # Called with the condition held.
+        if self.waiting_for_sweep_start:
+            if self.accumulator.sweep_hz_low is not None and hz_low != self.accumulator.sweep_hz_low:
+                return
+            self.waiting_for_sweep_start = False
+        for accumulator in self.accumulators:
+            accumulator.add_row(hz_low, values)
+
+    def _read_stdout(self, process):
+        for line in process.stdout:
+            fields = line.split(',', 6)
+            if len(fields) < 7:
+                continue
+            with self.condition:
+                parse_start = time.time()
+                self.add_row(int(fields[2]), np.fromstring(fields[6], sep=','))
+                self.parse_time += time.time() - parse_start
+                self.condition.notify_all()
+        with self.condition:
+            self.condition.notify_all()
+
+    def _read_records(self, process, records_per_read=64):
+        # Binary output is read straight into a preallocated buffer of records, which is reused for every read.
+        header = process.stdout.read(4)
+        if len(header) == 4:
+            dtype = get_sweep_record_dtype(int.from_bytes(header, 'little'))
+            buffer = np.zeros(records_per_read * dtype.itemsize, dtype=np.uint8)
+            records = buffer.view(dtype)
+            view = memoryview(buffer)
+            view[:4] = header
+            number_of_bytes = 4
+            while True:
+                number_of_read_bytes = process.stdout.readinto1(view[number_of_bytes:])
+                if not number_of_read_bytes:
+                    break
+                number_of_bytes += number_of_read_bytes
+                number_of_records = number_of_bytes // dtype.itemsize
+
+                with self.condition:
+                    parse_start = time.time()
+                    for hz_low, powers in zip(records['hz_low'][:number_of_records].tolist(), records['powers'][:number_of_records]):
+                        self.add_row(hz_low, powers)
+                    self.parse_time += time.time() - parse_start
+                    self.condition.notify_all()
+
+                # A record that is only partly read moves to the start of the buffer.
+                remaining_bytes = number_of_bytes - number_of_records * dtype.itemsize
+                view[:remaining_bytes] = view[number_of_bytes - remaining_bytes:number_of_bytes]
+                number_of_bytes = remaining_bytes
+        with self.condition:
+            self.condition.notify_all()
+
+    def _read_stderr(self, process):
+        # hackrf_sweep reports progress on stderr, which must be drained so that the process never blocks.
+        for line in process.stderr:
+            self.stderr_lines.append(line.rstrip())
+
+    def read_spectra(self, number_of_sweeps):
+        # Returns the spectrum of every interval.
+        for _ in range(3):
+            if self.process is None or self.process.poll() is not None:
+                if self.process is not None:
+                    self.logger.error('Failed to get data from HackRF One.')
+                    self.logger.error('\n' + '\n'.join(self.stderr_lines))
+                    self.close()
+                    metrics.HACKRF_RETRIES.inc()
+
+                    # Wait for 10 seconds and try reading from HackRF One again.
+                    sleep(10)
+                try:
+                    self.open()
+                except Exception:
+                    self.logger.exception('Exception occurred when opening the sweep stream.')
+                    sleep(10)
+                    continue
+
+            hackrf_sweep_start = time.time()
+            with self.condition:
+                for accumulator in self.accumulators:
+                    accumulator.reset()
+                self.parse_time = 0.0
+                self.waiting_for_sweep_start = True
+                self.condition.wait_for(
+                    lambda: self.accumulator.number_of_sweeps >= number_of_sweeps or self.process.poll() is not None
+                )
+                if self.accumulator.number_of_sweeps >= number_of_sweeps:
+                    spectra = [accumulator.get_spectrum() for accumulator in self.accumulators]
+                    self.logger.debug('hackrf_sweep: {:.2f}'.format(time.time() - hackrf_sweep_start))
+                    return spectra
+        return [SweepAccumulator(i['start'], i['end'], i['width']).get_spectrum() for i in self.intervals]
+
+
+def scan_spectrum(source, number_of_measurements, start, end, width):
+    output = source.read(number_of_measurements, start, end, width)
+    return parse_sweep_output(output, start, end, width)
+
+
+def detect_emitters(tuned_powers, monitor_powers, sensitivity, ignored_mask):
+    peak_indices, peak_ignored, _, _ = cluster_emitters(tuned_powers, monitor_powers, sensitivity, ignored_mask)
+    return peak_indices, peak_ignored
+
+
+def cluster_emitters(tuned_powers, monitor_powers, sensitivity, ignored_mask):
+    # Returns the peak bin of every emitter, whether it is ignored, and its first and last bin.
+    offsets = monitor_powers - tuned_powers
+    # Bins without a measurement are NaN and never exceed the threshold.
+    indices = np.flatnonzero(offsets >= sensitivity)
+    if not len(indices):
+        return indices, np.zeros(0, dtype=bool), indices, indices
+
+    # Adjacent bins over the threshold belong to the same emitter.
+    run_starts = np.flatnonzero(np.diff(indices, prepend=-2) > 1)
+    run_ids = np.repeat(np.arange(len(run_starts)), np.diff(np.append(run_starts, len(indices))))
+
+    # Within every emitter, prefer the strongest bin that is not ignored. An emitter is only reported as
+    # ignored if all of its bins are ignored.
+    ignored = ignored_mask[indices]
+    order = np.lexsort((-offsets[indices], ignored, run_ids))
+    peak_indices = indices[order[run_starts]]
+    run_ends = np.append(run_starts[1:], len(indices)) - 1
+    return peak_indices, ignored_mask[peak_indices], indices[run_starts], indices[run_ends]
+
+
+class Emitter:
+    # One transmission, from its first to its last detection. There can be many of these, so they are kept small.
+    __slots__ = (
+        'interval_index',
+        'start_timestamp',
+        'end_timestamp',
+        'low_frequency',
+        'high_frequency',
+        'peak_frequency',
+        'max_power',
+        'number_of_detections',
+        'ignored',
+        'detection_timestamp',
+        'detection_frequency'
+    )
+
+    def __init__(self, interval_index, timestamp, low_frequency, high_frequency, peak_frequency, power, ignored):
+        self.interval_index = interval_index
+        self.start_timestamp = timestamp
+        self.end_timestamp = timestamp
+        self.low_frequency = low_frequency
+        self.high_frequency = high_frequency
+        self.peak_frequency = peak_frequency
+        self.max_power = power
+        self.number_of_detections = 1
+        self.ignored = ignored
+        # The first detection that is not ignored names the graph and the measurement of the emitter.
+        self.detection_timestamp = timestamp
+        self.detection_frequency = peak_frequency
+
+    @property
+    def center_frequency(self):
+        return (self.low_frequency + self.high_frequency) // 2
+
+    @property
+    def bandwidth(self):
+        return self.high_frequency - self.low_frequency
+
+    @property
+    def duration(self):
+        return self.end_timestamp - self.start_timestamp
+
+    def overlaps(self, low_frequency, high_frequency, frequency_tolerance):
+        return low_frequency <= self.high_frequency + frequency_tolerance and high_frequency >= self.low_frequency - frequency_tolerance
+
+    def update(self, timestamp, low_frequency, high_frequency, peak_frequency, power, ignored):
+        # Returns True if this is the first detection of the emitter that is not ignored.
+        self.end_timestamp = timestamp
+        self.low_frequency = min(self.low_frequency, low_frequency)
+        self.high_frequency = max(self.high_frequency, high_frequency)
+        if power > self.max_power:
+            self.peak_frequency = peak_frequency
+            self.max_power = power
+        self.number_of_detections += 1
+        # An emitter is ignored only if all of its detections are.
+        if self.ignored and not ignored:
+            self.ignored = False
+            self.detection_timestamp = timestamp
+            self.detection_frequency = peak_frequency
             return True
+        return False
+
+
+class EmitterTracker:
+    def __init__(self, number_of_intervals, timeout=10, frequency_tolerance=12_500):
+        # A detection that overlaps an active emitter of its interval, give or take the frequency tolerance, belongs
+        # to it. An emitter ends when it was not detected for the timeout in seconds.
+        self.timeout = timeout
+        self.frequency_tolerance = frequency_tolerance
+        self.active_emitters = [list() for _ in range(number_of_intervals)]
+
+    def update(self, interval_index, timestamp, low_frequency, high_frequency, peak_frequency, power, ignored):
+        # Returns the emitter of the detection, and whether it is the first detection of the emitter that is not
+        # ignored.
+        for emitter in self.active_emitters[interval_index]:
+            if emitter.overlaps(low_frequency, high_frequency, self.frequency_tolerance):
+                return emitter, emitter.update(timestamp, low_frequency, high_frequency, peak_frequency, power, ignored)
+
+        emitter = Emitter(interval_index, timestamp, low_frequency, high_frequency, peak_frequency, power, ignored)
+        self.active_emitters[interval_index].append(emitter)
+        return emitter, not ignored
+
+    def expire(self, timestamp=None):
+        # Removes and returns the emitters that ended, or all of them without a timestamp.
+        ended_emitters = list()
+        for interval_index, emitters in enumerate(self.active_emitters):
+            if timestamp is None:
+                ended_emitters.extend(emitters)
+                self.active_emitters[interval_index] = list()
+                continue
+            ended_emitters.extend(emitter for emitter in emitters if timestamp - emitter.end_timestamp > self.timeout)
+            self.active_emitters[interval_index] = [emitter for emitter in emitters if timestamp - emitter.end_timestamp <= self.timeout]
+        return ended_emitters
+
+
+def merge_spectra(spectra):
+    frequencies = np.concatenate([frequencies for frequencies, _ in spectra])
+    powers = np.concatenate([powers for _, powers in spectra])
+    order = np.argsort(frequencies, kind='stable')
+    return frequencies[order], powers[order]
+
+
+class ScanScheduler:
+    def __init__(self, intervals, serial_numbers, logger):
+        self.intervals = intervals
+        self.serial_numbers = serial_numbers
+        self.logger = logger
+
+        # Give the widest intervals out first, each to the device with the least bandwidth to sweep so far.
+        self.device_intervals = {serial_number: list() for serial_number in serial_numbers}
+        device_bandwidth = {serial_number: 0 for serial_number in serial_numbers}
+        for interval_index in sorted(range(len(intervals)), key=lambda i: intervals[i]['start'] - intervals[i]['end']):
+            serial_number = min(serial_numbers, key=lambda s: device_bandwidth[s])
+            self.device_intervals[serial_number].append(interval_index)
+            device_bandwidth[serial_number] += intervals[interval_index]['end'] - intervals[interval_index]['start']
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(len(serial_numbers))
+
+    def _scan_device(self, scan_function, serial_number, number_of_samples):
+        scan_start = time.time()
+        spectra = dict()
+        for interval_index in self.device_intervals[serial_number]:
+            spectra[interval_index] = scan_function(interval_index, number_of_samples, serial_number)
+        return spectra, time.time() - scan_start
+
+    def scan(self, scan_function, number_of_samples):
+        # Every device sweeps its own intervals, all devices at the same time.
+        futures = {
+            serial_number: self.executor.submit(self._scan_device, scan_function, serial_number, number_of_samples)
+            for serial_number in self.serial_numbers
+        }
+
+        spectra = [None] * len(self.intervals)
+        for serial_number, future in futures.items():
+            device_spectra, scan_time = future.result()
+            number_of_bins = 0
+            for interval_index, spectrum in device_spectra.items():
+                spectra[interval_index] = spectrum
+                number_of_bins += len(spectrum[0])
+            if device_spectra:
+                device = serial_number or 'default'
+                metrics.DEVICE_SWEEP_RATE.set(number_of_samples * len(device_spectra) / scan_time, device=device)
+                metrics.DEVICE_BIN_RATE.set(number_of_samples * number_of_bins / scan_time, device=device)
+                self.logger.debug('Device {}: {:.1f} sweeps/s, {:,.0f} bins/s'.format(
+                    device,
+                    number_of_samples * len(device_spectra) / scan_time,
+                    number_of_samples * number_of_bins / scan_time
+                ))
+        return spectra
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class SubbandScheduler:
+    def __init__(self, intervals, subband_width=20, quiet_revisit_cycles=4, decay=0.8, hot_threshold=0.5):
+        # Every interval is split into sub-bands of whole MHz, because hackrf_sweep takes its range in MHz. The
+        # intervals already leave out the excluded frequencies, and so do the sub-bands. hackrf_sweep tunes in steps
+        # of 20 MHz and rounds every range up to them, so narrower sub-bands take as long to sweep.
+        self.intervals = intervals
+        self.quiet_revisit_cycles = quiet_revisit_cycles
+        self.decay = decay
+        self.hot_threshold = hot_threshold
+        self.subbands = list()
+        for interval in intervals:
+            edges = list(range(interval['start'], interval['end'], subband_width)) + [interval['end']]
+            self.subbands.append(list(zip(edges, edges[1:])))
+
+        self.activity = [np.zeros(len(subbands)) for subbands in self.subbands]
+        # Quiet sub-bands are staggered, so that every cycle visits about the same number of them.
+        self.last_visits = [-(np.arange(len(subbands)) % min(len(subbands), quiet_revisit_cycles)) for subbands in self.subbands]
+        self.cycle = 0
+        self.ranges = [[(interval['start'], interval['end'])] for interval in intervals]
+
+    def get_slice(self, interval_index, start, end):
+        interval = self.intervals[interval_index]
+        first_bin = int(round((start - interval['start']) * 1_000_000 / interval['width']))
+        last_bin = int(round((end - interval['start']) * 1_000_000 / interval['width']))
+        return slice(first_bin, last_bin)
+
+    def plan(self, ignored_masks):
+        # Hot sub-bands are swept every cycle and quiet ones at least every quiet_revisit_cycles cycles. Sub-bands
+        # that are ignored completely are never swept. Adjacent sub-bands are swept together, with one hackrf_sweep.
+        self.cycle += 1
+        for interval_index, subbands in enumerate(self.subbands):
+            ignored = np.array([ignored_masks[interval_index][self.get_slice(interval_index, *subband)].all() for subband in subbands])
+            hot = self.activity[interval_index] >= self.hot_threshold
+            due = self.cycle - self.last_visits[interval_index] >= self.quiet_revisit_cycles
+            visited = (hot | due) & ~ignored
+            # An interval with fewer sub-bands than quiet_revisit_cycles would otherwise sweep nothing in some cycles.
+            if not visited.any() and not ignored.all():
+                visited[np.argmin(np.where(ignored, np.inf, self.last_visits[interval_index]))] = True
+            self.last_visits[interval_index][visited] = self.cycle
+
+            ranges = list()
+            for (start, end), subband_visited in zip(subbands, visited.tolist()):
+                if not subband_visited:
+                    continue
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1] = (ranges[-1][0], end)
+                else:
+                    ranges.append((start, end))
+            self.ranges[interval_index] = ranges
+
+            # Activity decays every cycle and every detection that is not ignored adds to it.
+            self.activity[interval_index] *= self.decay
+        return self.ranges
+
+    def update(self, interval_index, frequencies):
+        starts = np.array([start for start, _ in self.subbands[interval_index]]) * 1_000_000
+        subband_indices = np.searchsorted(starts, frequencies, side='right') - 1
+        np.add.at(self.activity[interval_index], subband_indices, 1)
+
+    def get_bandwidth(self):
+        # The MHz swept in the current cycle and in total.
+        return (
+            sum(end - start for ranges in self.ranges for start, end in ranges),
+            sum(interval['end'] - interval['start'] for interval in self.intervals)
+        )
 
 
-def scan_frequencies(number_of_measurements, start, end, width, lna_gain, vga_gain, rx_amp, bias_tee, logger, integration_enabled=False):
-    command = [
-        'hackrf_sweep',
-        '-l {}'.format(lna_gain),
-        '-g {}'.format(vga_gain),
-        '-a {}'.format(rx_amp),
-        '-p {}'.format(bias_tee),
-        '-N {}'.format(number_of_measurements),
-        '-f {}:{}'.format(start, end),
-        '-w {}'.format(width)
-    ]
+class Baseline:
+    def __init__(self, intervals, alpha):
+        self.intervals = intervals
+        self.alpha = alpha
+        self.frequencies = [SweepAccumulator(i['start'], i['end'], i['width']).frequencies for i in intervals]
+        self.powers = [None] * len(intervals)
+
+    def get_key(self, interval_index):
+        interval = self.intervals[interval_index]
+        return 'interval_{}_{}_{}'.format(interval['start'], interval['end'], interval['width'])
+
+    def set(self, interval_index, powers):
+        self.powers[interval_index] = np.array(powers, dtype=np.float32)
+
+    def update(self, interval_index, powers, sensitivity):
+        # Exponential moving average per bin. Bins over the threshold adapt ten times slower, so that an emitter
+        # does not disappear into the baseline right away but a permanent one eventually does.
+        baseline = self.powers[interval_index]
+        measured = ~np.isnan(powers)
+        new = measured & np.isnan(baseline)
+        baseline[new] = powers[new]
+
+        alpha = np.where(powers - baseline >= sensitivity, self.alpha / 10, self.alpha)
+        updated = measured & ~new
+        baseline[updated] += alpha[updated] * (powers[updated] - baseline[updated])
+
+    def save(self, file_path):
+        # Write to a temporary file first, so that a crash never leaves a truncated baseline behind.
+        temp_file_path = file_path + '.tmp'
+        with open(temp_file_path, 'wb') as file:
+            np.savez(file, **{self.get_key(i): powers for i, powers in enumerate(self.powers)})
+        os.replace(temp_file_path, file_path)
+
+    def load(self, file_path):
+        if not os.path.isfile(file_path):
+            return False
+
+        with np.load(file_path) as data:
+            for interval_index in range(len(self.intervals)):
+                key = self.get_key(interval_index)
+                if key in data and data[key].shape == self.frequencies[interval_index].shape:
+                    self.set(interval_index, data[key])
+        return all(powers is not None for powers in self.powers)
+
+
+def scan_frequencies(number_of_measurements, start, end, width, lna_gain, vga_gain, rx_amp, bias_tee, logger, binary=False):
+    source = HackRFSweepSource(lna_gain, vga_gain, rx_amp, bias_tee, logger, binary=binary)
+    return spectrum_to_dict(*scan_spectrum(source, number_of_measurements, start, end, width))
+
+
+def get_live_settings(config_cache):
+    # The settings are updated in place every time the config file changes.
+    settings = get_settings(config_cache.get_config())
+    config_cache.add_listener(lambda config: settings.update(get_settings(config)))
+    return settings
+
+
+class Acquisition:
+    def __init__(self, config_cache, intervals, logger, tune_first=False):
+        config = config_cache.get_config()
+        self.config_cache = config_cache
+        self.intervals = intervals
+        self.logger = logger
+        self.tune_first = tune_first
+        self.settings = get_settings(config)
+        self.source_config = config.get('source', {})
+        self.streaming_enabled = config.get('streaming_enabled', False)
+        self.scan_scheduler = ScanScheduler(intervals, config.get('hackrf_serial_numbers', [None]), logger)
+        self.interval_frequencies = [SweepAccumulator(i['start'], i['end'], i['width']).frequencies for i in intervals]
+        self.interval_labels = [metrics.get_interval_label(interval) for interval in intervals]
+        self.last_scan_times = dict()
+
+        # Every device gets its own source. Sweeps are read from hackrf_sweep unless the config selects a replay or
+        # synthetic source, and with streaming every device keeps one long-running stream over its intervals.
+        self.sources = dict()
+        self.streams = list()
+        self.interval_streams = dict()
+        self.stream_spectra = dict()
+        self.open_sources()
+        config_cache.add_listener(self.reload_settings)
+
+        # Sub-bands with recent detections are swept every cycle and quiet ones less often. Streams keep sweeping the
+        # whole interval, so they are not scheduled.
+        self.subband_scheduler = None
+        if config.get('adaptive_enabled', False):
+            if self.streaming_enabled:
+                logger.warning('Adaptive scheduling is not available with streaming, sweeping the whole intervals.')
+            else:
+                self.subband_scheduler = SubbandScheduler(
+                    intervals,
+                    config.get('adaptive_subband_width', 20),
+                    config.get('adaptive_quiet_revisit_cycles', 4),
+                    config.get('adaptive_decay', 0.8),
+                    config.get('adaptive_hot_threshold', 0.5)
+                )
+        self.masked_ignored_frequencies = None
+        self.interval_ignored_masks = None
+
+    def open_sources(self):
+        for stream, _ in self.streams:
+            stream.close()
+        self.streams.clear()
+        self.interval_streams.clear()
+        self.stream_spectra.clear()
+        for serial_number in self.scan_scheduler.serial_numbers:
+            self.sources[serial_number] = get_source(
+                self.source_config,
+                self.settings['lna_gain'],
+                self.settings['vga_gain'],
+                self.settings['rx_amp'],
+                self.settings['bias_tee'],
+                self.logger,
+                serial_number
+            )
+        if not self.streaming_enabled:
+            return
+
+        # hackrf_sweep has one bin width and at most MAX_SWEEP_RANGES ranges, so a device only needs more than one
+        # stream for intervals with other widths or beyond that.
+        for serial_number, interval_indices in self.scan_scheduler.device_intervals.items():
+            width_interval_indices = collections.defaultdict(list)
+            for interval_index in sorted(interval_indices, key=lambda i: self.intervals[i]['start']):
+                width_interval_indices[self.intervals[interval_index]['width']].append(interval_index)
+            for indices in width_interval_indices.values():
+                for chunk_start in range(0, len(indices), MAX_SWEEP_RANGES):
+                    stream_interval_indices = indices[chunk_start:chunk_start + MAX_SWEEP_RANGES]
+                    stream = SweepStream(self.sources[serial_number], [self.intervals[i] for i in stream_interval_indices], self.logger)
+                    self.streams.append((stream, stream_interval_indices))
+                    for interval_index in stream_interval_indices:
+                        self.interval_streams[interval_index] = (stream, stream_interval_indices)
+
+    def reload_settings(self, config):
+        new_settings = get_settings(config)
+        changed_settings = [name for name in new_settings if new_settings[name] != self.settings[name]]
+        if not changed_settings:
+            return
+
+        self.logger.info('Reloaded settings {}.'.format(', '.join(changed_settings)))
+        self.settings.update(new_settings)
+        if {'lna_gain', 'vga_gain', 'rx_amp', 'bias_tee'} & set(changed_settings):
+            self.open_sources()
+
+    def record_scan(self, interval_index):
+        scan_start = time.time()
+        if interval_index in self.last_scan_times:
+            metrics.REVISIT_SECONDS.set(scan_start - self.last_scan_times[interval_index], interval=self.interval_labels[interval_index])
+        self.last_scan_times[interval_index] = scan_start
+        return scan_start
+
+    def scan_interval(self, interval_index, number_of_samples, serial_number):
+        interval = self.intervals[interval_index]
+        interval_label = self.interval_labels[interval_index]
+        scan_start = self.record_scan(interval_index)
+
+        if self.streaming_enabled:
+            # Streams parse every row as it arrives, while waiting for the sweeps. A stream reads all of its intervals
+            # at once, and the other intervals take their spectra when they are scanned next on the same device.
+            if interval_index not in self.stream_spectra:
+                stream, stream_interval_indices = self.interval_streams[interval_index]
+                # A HackRF can be opened only once, so the other streams of the device are stopped first.
+                for other_stream, other_interval_indices in self.streams:
+                    if other_stream is not stream and other_interval_indices[0] in self.scan_scheduler.device_intervals[serial_number]:
+                        other_stream.close()
+                spectra = stream.read_spectra(number_of_samples)
+                sweep_time = time.time() - scan_start - stream.parse_time
+                for stream_interval_index, spectrum in zip(stream_interval_indices, spectra):
+                    self.stream_spectra[stream_interval_index] = spectrum
+                    metrics.SWEEP_SECONDS.observe(sweep_time, interval=self.interval_labels[stream_interval_index])
+                    metrics.PARSE_SECONDS.observe(stream.parse_time, interval=self.interval_labels[stream_interval_index])
+            return self.stream_spectra.pop(interval_index)
+
+        return self.scan_ranges(interval_index, number_of_samples, serial_number, [(interval['start'], interval['end'])])
+
+    def scan_ranges(self, interval_index, number_of_samples, serial_number, ranges):
+        # Returns the spectrum of the whole interval. Its bins outside the ranges are NaN, unless hackrf_sweep swept
+        # them anyway.
+        interval = self.intervals[interval_index]
+        sweep_start = time.time()
+        output = self.sources[serial_number].read_ranges(number_of_samples, ranges, interval['width'])
+        parse_start = time.time()
+        spectrum = parse_sweep_output(output, interval['start'], interval['end'], interval['width'])
+        metrics.SWEEP_SECONDS.observe(parse_start - sweep_start, interval=self.interval_labels[interval_index])
+        metrics.PARSE_SECONDS.observe(time.time() - parse_start, interval=self.interval_labels[interval_index])
+        return spectrum
+
+    def scan_subbands(self, interval_index, number_of_samples, serial_number):
+        # Only the planned sub-bands are swept, all of them with one hackrf_sweep, so that the device is opened once.
+        # The bins of the others are NaN, which detection and the baseline skip.
+        powers = np.full(len(self.interval_frequencies[interval_index]), np.nan, dtype=np.float32)
+        ranges = self.subband_scheduler.ranges[interval_index]
+        if ranges:
+            self.record_scan(interval_index)
+        for chunk_start in range(0, len(ranges), MAX_SWEEP_RANGES):
+            _, chunk_powers = self.scan_ranges(interval_index, number_of_samples, serial_number, ranges[chunk_start:chunk_start + MAX_SWEEP_RANGES])
+            np.copyto(powers, chunk_powers, where=~np.isnan(chunk_powers))
+        return self.interval_frequencies[interval_index], powers
+
+    def update_activity(self, interval_index, frequencies):
+        if self.subband_scheduler is not None:
+            self.subband_scheduler.update(interval_index, frequencies)
+
+    def run_cycle(self, emit):
+        # Picks up changed gains, sample counts and integration. In the pipeline, nothing else reloads the config of
+        # this process.
+        self.config_cache.reload()
+        if self.tune_first:
+            self.logger.info('Tuning to the radio frequencies.')
+            spectra = self.scan_scheduler.scan(self.scan_interval, self.settings['tune_number_of_samples'])
+            emit({'type': 'tune', 'powers': [powers for _, powers in spectra]})
+            self.tune_first = False
+
+        start = time.time()
+        self.logger.info('Monitoring the radio frequencies.')
+
+        scan_function = self.scan_interval
+        if self.subband_scheduler is not None:
+            ignored_frequencies = self.config_cache.get_ignored_frequencies()
+            if ignored_frequencies is not self.masked_ignored_frequencies:
+                self.interval_ignored_masks = [ignored_frequencies.mask(frequencies) for frequencies in self.interval_frequencies]
+                self.masked_ignored_frequencies = ignored_frequencies
+            self.subband_scheduler.plan(self.interval_ignored_masks)
+            swept_bandwidth, total_bandwidth = self.subband_scheduler.get_bandwidth()
+            self.logger.debug('Sweeping {} of {} MHz'.format(swept_bandwidth, total_bandwidth))
+            if not swept_bandwidth:
+                # Every sub-band is ignored, so a cycle would only give empty spectra.
+                self.logger.warning('All the frequencies are ignored, nothing to sweep.')
+                time.sleep(1)
+                return
+            scan_function = self.scan_subbands
+
+        interval_spectra = list()
+        for _ in range(self.settings['integration']):
+            spectra = self.scan_scheduler.scan(scan_function, self.settings['monitor_number_of_samples'])
+            interval_spectra.append([powers for _, powers in spectra])
+        emit({'type': 'monitor', 'start': start, 'timestamp': datetime.today(), 'spectra': interval_spectra})
+
+    def close(self):
+        for stream, _ in self.streams:
+            stream.close()
+        self.scan_scheduler.close()
+
+
+class Processor:
+    def __init__(self, config_cache, intervals, baseline, baseline_file_path, logger):
+        self.config_cache = config_cache
+        self.intervals = intervals
+        self.baseline = baseline
+        self.baseline_file_path = baseline_file_path
+        self.logger = logger
+        self.settings = get_live_settings(config_cache)
+        self.interval_labels = [metrics.get_interval_label(interval) for interval in intervals]
+        self.emitter_tracker = EmitterTracker(
+            len(intervals),
+            config_cache.get_config().get('emitter_timeout', 10),
+            config_cache.get_config().get('emitter_frequency_tolerance', 12_500)
+        )
+        self.number_of_remaining_cycles = 0
+        self.masked_ignored_frequencies = None
+        self.interval_ignored_masks = None
+
+    def process(self, message, emit, feedback):
+        if message['type'] == 'tune':
+            for interval_index, tuned_powers in enumerate(message['powers']):
+                self.baseline.set(interval_index, tuned_powers)
+            return
+
+        # Every tuning period starts with saving the baseline and graphing it.
+        if not self.number_of_remaining_cycles:
+            self.baseline.save(self.baseline_file_path)
+            emit({'type': 'tune', 'timestamp': datetime.today(), 'powers': [powers.copy() for powers in self.baseline.powers]})
+            self.number_of_remaining_cycles = self.settings['tuning_period']
+        self.number_of_remaining_cycles -= 1
+
+        # The config and the ignore masks are only rebuilt when the config file changes.
+        ignored_frequencies = self.config_cache.get_ignored_frequencies()
+        if ignored_frequencies is not self.masked_ignored_frequencies:
+            self.interval_ignored_masks = [ignored_frequencies.mask(frequencies) for frequencies in self.baseline.frequencies]
+            self.masked_ignored_frequencies = ignored_frequencies
+
+        interval_tuned_powers = self.baseline.powers
+        interval_monitor_powers = [tuned_powers.copy() for tuned_powers in interval_tuned_powers]
+        for spectra in message['spectra']:
+            for interval_index, temp_monitor_powers in enumerate(spectra):
+                interval_monitor_powers[interval_index] += temp_monitor_powers - interval_tuned_powers[interval_index]
+        emit({'type': 'monitor', 'timestamp': message['timestamp'], 'powers': interval_monitor_powers})
+
+        for interval_index in range(len(self.intervals)):
+            frequencies = self.baseline.frequencies[interval_index]
+            tuned_powers = interval_tuned_powers[interval_index]
+            monitor_powers = interval_monitor_powers[interval_index]
+
+            detection_start = time.time()
+            peak_indices, peak_ignored, low_indices, high_indices = cluster_emitters(
+                tuned_powers,
+                monitor_powers,
+                self.settings['sensitivity'],
+                self.interval_ignored_masks[interval_index]
+            )
+            metrics.DETECTION_SECONDS.observe(time.time() - detection_start, interval=self.interval_labels[interval_index])
+            metrics.DETECTIONS.inc(len(peak_indices), interval=self.interval_labels[interval_index])
+            metrics.IGNORED_DETECTIONS.inc(int(np.count_nonzero(peak_ignored)), interval=self.interval_labels[interval_index])
+            if not len(peak_indices):
+                continue
+            if not peak_ignored.all():
+                feedback(interval_index, frequencies[peak_indices[~peak_ignored]])
+
+            # The bins of an emitter are merged, and its detections in consecutive cycles belong to the same
+            # emitter. An emitter is graphed once, on its first detection that is not ignored.
+            timestamp = time.time()
+            half_width = self.intervals[interval_index]['width'] // 2
+            new_emitters = list()
+            strongest_frequency = None
+            strongest_frequency_offset = None
+            for peak_index, ignored, low_index, high_index in zip(peak_indices.tolist(), peak_ignored.tolist(), low_indices.tolist(), high_indices.tolist()):
+                frequency = int(frequencies[peak_index])
+                emitter, detected = self.emitter_tracker.update(
+                    interval_index,
+                    timestamp,
+                    int(frequencies[low_index]) - half_width,
+                    int(frequencies[high_index]) + half_width,
+                    frequency,
+                    float(monitor_powers[peak_index]),
+                    ignored
+                )
+                if ignored:
+                    continue
+
+                if detected:
+                    self.logger.warning('{:,} Hz  ::  {:.2f} db > '
+                                        ' {:.2f} db + {:.2f} db'.format(
+                        frequency,
+                        monitor_powers[peak_index],
+                        tuned_powers[peak_index],
+                        self.settings['sensitivity']
+                    ))
+                    new_emitters.append((timestamp, frequency))
+
+                frequency_offset = float(monitor_powers[peak_index] - tuned_powers[peak_index])
+                if strongest_frequency is None or frequency_offset > strongest_frequency_offset:
+                    strongest_frequency = frequency
+                    strongest_frequency_offset = frequency_offset
+
+            if new_emitters or strongest_frequency is not None:
+                emit({
+                    'type': 'detections',
+                    'interval_index': interval_index,
+                    'new_emitters': new_emitters,
+                    'tuned_powers': tuned_powers.copy() if new_emitters else None,
+                    'monitor_powers': monitor_powers if new_emitters else None,
+                    'strongest_frequency': strongest_frequency,
+                    'strongest_frequency_offset': strongest_frequency_offset
+                })
+
+        ended_emitters = self.emitter_tracker.expire(time.time())
+        if ended_emitters:
+            emit({'type': 'emitters', 'emitters': ended_emitters})
+
+        # Every monitor sweep also updates the baseline, so monitoring never pauses to tune again.
+        for spectra in message['spectra']:
+            for interval_index, temp_monitor_powers in enumerate(spectra):
+                self.baseline.update(interval_index, temp_monitor_powers, self.settings['sensitivity'])
+
+        end = time.time()
+        self.logger.debug("Interval: {:.2f}".format(end - message['start']))
+        metrics.CYCLE_SECONDS.observe(end - message['start'])
+
+    def close(self, emit):
+        # Emitters that are still active are stored as they are.
+        ended_emitters = self.emitter_tracker.expire()
+        if ended_emitters:
+            emit({'type': 'emitters', 'emitters': ended_emitters})
+        if all(powers is not None for powers in self.baseline.powers):
+            self.baseline.save(self.baseline_file_path)
+
+
+class Sinks:
+    def __init__(self, config_cache, intervals, graphs_dir_path, logger):
+        config = config_cache.get_config()
+        self.config_cache = config_cache
+        self.intervals = intervals
+        self.graphs_dir_path = graphs_dir_path
+        self.logger = logger
+        self.settings = get_live_settings(config_cache)
+        self.interval_frequencies = [SweepAccumulator(i['start'], i['end'], i['width']).frequencies for i in intervals]
+        self.interval_labels = [metrics.get_interval_label(interval) for interval in intervals]
+
+        self.graph_renderer = GraphRenderer(
+            logger,
+            config.get('graph_workers', 1),
+            config.get('graph_queue_size', 16),
+            config.get('graph_queue_policy', 'coalesce')
+        )
+        self.measurements_log = MeasurementsLog(graphs_dir_path, config.get('measurements_flush_interval', 5))
+        self.krakensdr_tuner = KrakenSDRTuner(self.settings, logger)
+
+        # Every tuned and monitored spectrum can be kept for replaying it later.
+        self.archive = None
+        if config.get('archive_enabled', False):
+            self.archive = spectrum_archive.SpectrumArchive(graphs_dir_path, intervals)
+
+        # The merged spectrum of every cycle is published for the live_spectrum server.
+        self.live_spectrum = None
+        if config.get('live_spectrum_name'):
+            self.live_spectrum = SpectrumRingBuffer.create(
+                config['live_spectrum_name'],
+                np.sort(np.concatenate(self.interval_frequencies), kind='stable'),
+                config.get('live_spectrum_slots', 256)
+            )
 
-    logger.info('Running command "{}"'.format(' '.join(command)))
-    hackrf_sweep_start = time.time()
-    for _ in range(3):
+    def handle(self, event):
+        if event['type'] == 'tune':
+            self.handle_tune(event)
+        elif event['type'] == 'monitor':
+            self.handle_monitor(event)
+        elif event['type'] == 'detections':
+            self.handle_detections(event)
+        elif event['type'] == 'emitters':
+            self.handle_emitters(event)
+        self.poll()
+
+    def handle_tune(self, event):
+        timestamp = event['timestamp']
+        ignored_frequencies = self.config_cache.get_ignored_frequencies()
+        for interval_index, interval in enumerate(self.intervals):
+            file_name = '{}-tune-{}-{}.pdf'.format(timestamp.strftime('%H_%M_%S'), interval['start'], interval['end'])
+            file_path = os.path.join(self.graphs_dir_path, timestamp.strftime('%y_%m_%d'), 'measurements', file_name)
+            if self.archive is not None:
+                self.archive.append(timestamp, interval_index, spectrum_archive.TUNE, event['powers'][interval_index])
+            self.graph_renderer.submit(
+                file_path,
+                interval['start'],
+                interval['end'],
+                self.interval_frequencies[interval_index],
+                event['powers'][interval_index],
+                None,
+                0,
+                ignored_frequencies,
+                key=('tune', interval_index)
+            )
+
+    def handle_monitor(self, event):
+        if self.archive is not None:
+            for interval_index, monitor_powers in enumerate(event['powers']):
+                self.archive.append(event['timestamp'], interval_index, spectrum_archive.MONITOR, monitor_powers)
+            self.archive.flush()
+
+        # All devices together produce one spectrum per cycle.
+        cycle_frequencies, cycle_powers = merge_spectra(list(zip(self.interval_frequencies, event['powers'])))
+        self.logger.debug('Spectrum: {:,} bins from {:,} Hz to {:,} Hz, {:.2f} db max'.format(
+            len(cycle_frequencies),
+            cycle_frequencies[0],
+            cycle_frequencies[-1],
+            np.nanmax(cycle_powers)
+        ))
+        if self.live_spectrum is not None:
+            self.live_spectrum.publish(time.time(), cycle_powers)
+
+        self.logger.debug('Graphs: {queue_depth} queued, {rendered} rendered, {dropped} dropped, {coalesced} coalesced, '
+                          '{mean_render_time:.2f} s mean and {max_render_time:.2f} s max render time'.format(**self.graph_renderer.get_metrics()))
+
+    def handle_detections(self, event):
+        interval = self.intervals[event['interval_index']]
+        ignored_frequencies = self.config_cache.get_ignored_frequencies()
+        for timestamp, frequency in event['new_emitters']:
+            timestamp = datetime.fromtimestamp(timestamp)
+            file_name = '{}-{:03d}_{:03d}_{:03d}.pdf'.format(
+                timestamp.strftime('%H_%M_%S'),
+                int(frequency / 1_000_000),
+                int(frequency % 1_000_000 / 1_000),
+                int(frequency % 1_000)
+            )
+            file_path = os.path.join(self.graphs_dir_path, timestamp.strftime('%y_%m_%d'), 'measurements', file_name)
+            self.graph_renderer.submit(
+                file_path,
+                interval['start'],
+                interval['end'],
+                self.interval_frequencies[event['interval_index']],
+                event['tuned_powers'],
+                event['monitor_powers'],
+                frequency,
+                ignored_frequencies,
+                key=frequency
+            )
+
+        # Point the KrakenSDR at the strongest emitter of the interval.
+        if self.settings['update_krakensdr'] and event['strongest_frequency'] is not None:
+            self.krakensdr_tuner.request(event['strongest_frequency'] / 1_000_000, event['strongest_frequency_offset'])
+
+    def handle_emitters(self, event):
+        # Store one measurement per emitter. Its timestamp and frequency are those of the graph, so that
+        # plot_measurements links to it.
+        for emitter in event['emitters']:
+            self.measurements_log.write(
+                datetime.fromtimestamp(emitter.detection_timestamp),
+                emitter.detection_frequency,
+                emitter.ignored,
+                (
+                    '{:.1f}'.format(emitter.duration),
+                    emitter.center_frequency,
+                    emitter.bandwidth,
+                    '{:.2f}'.format(emitter.max_power),
+                    emitter.number_of_detections
+                )
+            )
+            metrics.EMITTERS.inc(interval=self.interval_labels[emitter.interval_index])
+            if not emitter.ignored:
+                self.logger.info('{:,} Hz  ::  {:,} Hz wide for {:.0f} s, {:.2f} db max'.format(
+                    emitter.peak_frequency,
+                    emitter.bandwidth,
+                    emitter.duration,
+                    emitter.max_power
+                ))
+
+    def poll(self):
+        # A retune that waited for the dwell time is done even when nothing new is detected.
+        if self.settings['update_krakensdr']:
+            self.krakensdr_tuner.poll()
+        self.measurements_log.poll()
+
+    def close(self):
+        self.graph_renderer.close()
+        self.measurements_log.close()
+        if self.archive is not None:
+            self.archive.close()
+        if self.live_spectrum is not None:
+            self.live_spectrum.close()
+
+
+class PipelineQueue:
+    def __init__(self, name, maxsize, context):
+        # Every process keeps the metrics of its own end of the queue: the producer how long it was blocked and how
+        # much it dropped, and the consumer how long it waited for work. The depth is set by the main process.
+        self.name = name
+        self.queue = context.Queue(maxsize)
+
+    def update_depth(self):
         try:
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except Exception:
-            logger.error('Exception occurred when running command "{}"'.format(command))
-            sleep(10)
-            continue
-
-        if result.returncode != 0:
-            logger.error('Failed to get data from HackRF One.')
-            logger.error('\n' + result.stderr.decode().strip())
-
-            # Wait for 10 seconds and try reading from HackRF One again.
-            sleep(10)
-        else:
-            break
-    logger.debug('Reading output from HackRF One')
-    output = result.stdout.decode()
-    logger.debug('Received output from HackRF One')
-
-    hackrf_sweep_end = time.time()
-    logger.debug('hackrf_sweep: {:.2f}'.format(hackrf_sweep_end - hackrf_sweep_start))
-
-    frequency = start * 1_000_000
-    measurements = dict()
-    if integration_enabled:
-        values = output.split(',')
-        for value in values[:-1]:
-            measurements[frequency] = float(value)
-            frequency += width
-    else:
-        csvreader = csv.reader(io.StringIO(output), delimiter=',', skipinitialspace=True)
-        measurements_sum = dict()
-        measurements_count = dict()
-        for line in csvreader:
-            hz_low = int(line[2])
-
-            for number, value in enumerate(line[6:], start=1):
-                # Calculate the frequency for each bin and convert to MHz
-                frequency = int(hz_low + (int(width) * number) - (int(width) / 2))
-                # Ignore frequencies that fall outside the measurement range.
-                if start * 1_000_000 < frequency < end * 1_000_000:
-                    if frequency not in measurements_sum:
-                        measurements_sum[frequency] = 0.0
-                        measurements_count[frequency] = 0.0
-                    measurements_sum[frequency] += float(value)
-                    measurements_count[frequency] += 1
-
-        for frequency in measurements_sum:
-            measurements[frequency] = measurements_sum[frequency] / measurements_count[frequency]
-    return measurements
+            metrics.PIPELINE_QUEUE_DEPTH.set(self.queue.qsize(), queue=self.name)
+        except NotImplementedError:
+            pass
+
+    def put(self, item, block=True, timeout=None):
+        put_start = time.time()
+        try:
+            self.queue.put(item, block, timeout)
+        except queue.Full:
+            metrics.PIPELINE_DROPS.inc(queue=self.name)
+            return False
+        finally:
+            metrics.PIPELINE_BLOCKED_SECONDS.inc(time.time() - put_start, queue=self.name)
+        metrics.PIPELINE_PUTS.inc(queue=self.name)
+        return True
+
+    def get(self, block=True, timeout=None):
+        get_start = time.time()
+        try:
+            return self.queue.get(block, timeout)
+        finally:
+            metrics.PIPELINE_IDLE_SECONDS.inc(time.time() - get_start, queue=self.name)
+
+
+def get_stage_logger(log_queue, log_level):
+    # The stages log through the process that started them, so that only one process writes the log file.
+    logger = logging.getLogger(__name__)
+    logger.setLevel(log_level)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    return logger
+
+
+def start_stage(log_queue, log_level):
+    ignore_signals()
+    return get_stage_logger(log_queue, log_level)
+
+
+def report_stage(stats_queue, stage_name, last_report_time):
+    if time.time() - last_report_time < 1:
+        return last_report_time
+    try:
+        stats_queue.put((stage_name, metrics.REGISTRY.get_values()), block=False)
+    except queue.Full:
+        pass
+    return time.time()
+
+
+def run_acquisition_stage(config_file_path, intervals, tune_first, spectra_queue, feedback_queue, stop_event, stats_queue, log_queue, log_level):
+    logger = start_stage(log_queue, log_level)
+    try:
+        acquisition = Acquisition(get_config_cache(config_file_path), intervals, logger, tune_first)
+        last_report_time = 0
+        try:
+            while not stop_event.is_set():
+                while True:
+                    try:
+                        acquisition.update_activity(*feedback_queue.get(block=False))
+                    except queue.Empty:
+                        break
+                # The sweeps wait for the processing stage only when its queue is full.
+                acquisition.run_cycle(spectra_queue.put)
+                last_report_time = report_stage(stats_queue, 'acquisition', last_report_time)
+        finally:
+            acquisition.close()
+    except Exception:
+        logger.exception('The acquisition stage failed.')
+    finally:
+        # The end of the spectra waits for room, so that the processing stage always finishes. A stage that is stuck
+        # is terminated by the main process.
+        spectra_queue.put(None)
+
+
+def run_processing_stage(config_file_path, intervals, baseline, baseline_file_path, spectra_queue, feedback_queue, events_queue, stats_queue, log_queue, log_level):
+    logger = start_stage(log_queue, log_level)
+
+    def emit(event):
+        # Spectra for the archive and the live spectrum are dropped when the sinks fall behind, detections and emitters wait.
+        events_queue.put(event, block=event['type'] in ('detections', 'emitters'))
+
+    def feedback(interval_index, frequencies):
+        feedback_queue.put((interval_index, frequencies), block=False)
+
+    try:
+        processor = Processor(get_config_cache(config_file_path), intervals, baseline, baseline_file_path, logger)
+        last_report_time = 0
+        try:
+            while True:
+                message = spectra_queue.get()
+                if message is None:
+                    break
+                processor.process(message, emit, feedback)
+                last_report_time = report_stage(stats_queue, 'processing', last_report_time)
+        finally:
+            processor.close(emit)
+    except Exception:
+        logger.exception('The processing stage failed.')
+    finally:
+        events_queue.put(None)
+
+
+def run_sinks_stage(config_file_path, intervals, graphs_dir_path, events_queue, stats_queue, log_queue, log_level):
+    logger = start_stage(log_queue, log_level)
+    try:
+        sinks = Sinks(get_config_cache(config_file_path), intervals, graphs_dir_path, logger)
+        last_report_time = 0
+        try:
+            while True:
+                try:
+                    event = events_queue.get(timeout=1)
+                except queue.Empty:
+                    sinks.poll()
+                    continue
+                if event is None:
+                    break
+                sinks.handle(event)
+                last_report_time = report_stage(stats_queue, 'sinks', last_report_time)
+        finally:
+            sinks.close()
+    except Exception:
+        logger.exception('The sinks stage failed.')
+
+
+def run_pipeline(config_file_path, config, intervals, baseline, baseline_file_path, tune_first, graphs_dir_path, logger, metrics_file_path):
+    # Acquisition, processing and the sinks run in their own processes, so that the SDR keeps sweeping while the
+    # spectra are processed and slow sinks never hold up the sweeps.
+    context = multiprocessing.get_context('spawn')
+    queue_size = config.get('pipeline_queue_size', 4)
+    spectra_queue = PipelineQueue('spectra', queue_size, context)
+    feedback_queue = PipelineQueue('feedback', 64, context)
+    events_queue = PipelineQueue('events', queue_size * 4, context)
+    stats_queue = context.Queue(64)
+    log_queue = context.Queue()
+    stop_event = context.Event()
+    log_level = logger.getEffectiveLevel()
+
+    log_listener = logging.handlers.QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    log_listener.start()
+    processes = [
+        context.Process(
+            target=run_acquisition_stage,
+            args=(config_file_path, intervals, tune_first, spectra_queue, feedback_queue, stop_event, stats_queue, log_queue, log_level),
+            name='acquisition'
+        ),
+        context.Process(
+            target=run_processing_stage,
+            args=(config_file_path, intervals, baseline, baseline_file_path, spectra_queue, feedback_queue, events_queue, stats_queue, log_queue, log_level),
+            name='processing'
+        ),
+        context.Process(
+            target=run_sinks_stage,
+            args=(config_file_path, intervals, graphs_dir_path, events_queue, stats_queue, log_queue, log_level),
+            name='sinks'
+        )
+    ]
+    for process in processes:
+        process.start()
+
+    stage_values = dict()
+    last_report_time = time.time()
+    try:
+        while all(process.is_alive() for process in processes):
+            try:
+                stage_name, values = stats_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            # The metrics of all stages are exported together by this process.
+            stage_values[stage_name] = values
+            metrics.REGISTRY.set_values(list(stage_values.values()))
+            for pipeline_queue in (spectra_queue, events_queue, feedback_queue):
+                pipeline_queue.update_depth()
+            if metrics_file_path:
+                metrics.write_metrics(metrics_file_path)
+
+            if time.time() - last_report_time >= 10:
+                last_report_time = time.time()
+                for pipeline_queue in (spectra_queue, events_queue, feedback_queue):
+                    logger.debug('Queue {}: {:.0f} queued, {:.0f} put, {:.0f} dropped, {:.2f} s blocked, {:.2f} s idle'.format(
+                        pipeline_queue.name,
+                        metrics.PIPELINE_QUEUE_DEPTH.get(queue=pipeline_queue.name),
+                        metrics.PIPELINE_PUTS.get(queue=pipeline_queue.name),
+                        metrics.PIPELINE_DROPS.get(queue=pipeline_queue.name),
+                        metrics.PIPELINE_BLOCKED_SECONDS.get(queue=pipeline_queue.name),
+                        metrics.PIPELINE_IDLE_SECONDS.get(queue=pipeline_queue.name)
+                    ))
+
+        stopped_stages = [process.name for process in processes if not process.is_alive()]
+        logger.error('The {} stage stopped, stopping the pipeline.'.format(', '.join(stopped_stages)))
+        return False
+    finally:
+        # The acquisition stops after its current cycle, and the other stages after the spectra that are queued.
+        stop_event.set()
+        for process in processes:
+            process.join(timeout=60)
+            if process.is_alive():
+                logger.error('The {} stage did not stop, terminating it.'.format(process.name))
+                process.terminate()
+        log_listener.stop()
 
 
 def main():
@@ -244,152 +1713,51 @@ def main():
     logger = get_logger(args.log_file_path)
     config_file_path = os.path.join(home_dir, args.config_file_path)
 
-    with open(config_file_path) as file:
-        config = json.loads(file.read())
+    # Stopping the process with SIGTERM still runs the atexit handlers that flush the logs and queues.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    config_cache = get_config_cache(config_file_path)
+    config = config_cache.get_config()
 
     intervals = get_intervals(config['included_frequencies'])
-    lna_gain = config.get('lna_gain', 16)
-    vga_gain = config.get('vga_gain', 16)
-    rx_amp = config.get('rx_amp', 0)
-    bias_tee = config.get('bias_tee', 0)
-    tune_number_of_samples = config.get('tune_number_of_samples', 200)
-    monitor_number_of_samples = config.get('monitor_number_of_samples', 20)
-    sensitivity = config.get('sensitivity', 10)
     graphs_dir_path = config.get('graphs_dir_path', os.path.join(home_dir, 'graphs'))
-    update_krakensdr = config.get('update_krakensdr', False)
-    integration = config.get('integration', 1)
-    tuning_period = config.get('tuning_period', 20)
-    krakensdr_config_file_path = config.get('krakensdr_config_file_path', '')
-
-    while True:
-        logger.info('Tuning to the radio frequencies.')
-        interval_tuned_frequency_mean = list()
-        for interval_index in range(len(intervals)):
-            interval_start = intervals[interval_index]['start']
-            interval_end = intervals[interval_index]['end']
-            interval_width = intervals[interval_index]['width']
-            tuned_frequency_mean = scan_frequencies(
-                tune_number_of_samples,
-                interval_start,
-                interval_end,
-                interval_width,
-                lna_gain,
-                vga_gain,
-                rx_amp,
-                bias_tee,
-                logger
-            )
-            interval_tuned_frequency_mean.append(tuned_frequency_mean)
-
-        timestamp = datetime.today()
-        dir_name = timestamp.strftime('%y_%m_%d')
-        dir_path = os.path.join(graphs_dir_path, dir_name)
-        if not os.path.isdir(dir_path):
-            os.mkdir(dir_path)
 
-        ignored_frequencies = get_ignored_frequencies(config_file_path)
-
-        for interval_index in range(len(intervals)):
-            interval_start = intervals[interval_index]['start']
-            interval_end = intervals[interval_index]['end']
-            tuned_frequency_mean = interval_tuned_frequency_mean[interval_index]
-
-            file_name = '{}-tune-{}-{}.pdf'.format(
-                timestamp.strftime('%H_%M_%S'),
-                interval_start,
-                interval_end
-            )
-            measurements_dir_path = os.path.join(dir_path, 'measurements')
-            if not os.path.isdir(measurements_dir_path):
-                os.mkdir(measurements_dir_path)
-            file_path = os.path.join(measurements_dir_path, file_name)
-            generate_graph(file_path, interval_start, interval_end, tuned_frequency_mean, dict(), 0, logger, ignored_frequencies)
-
-        for _ in range(tuning_period):
-            start = time.time()
-            logger.info('Monitoring the radio frequencies.')
-
-            ignored_frequencies = get_ignored_frequencies(config_file_path)
-
-            for interval_index in range(len(intervals)):
-                interval_start = intervals[interval_index]['start']
-                interval_end = intervals[interval_index]['end']
-                interval_width = intervals[interval_index]['width']
-
-                monitor_frequency_mean = dict()
-                for frequency in tuned_frequency_mean:
-                    monitor_frequency_mean[frequency] = tuned_frequency_mean[frequency]
-
-                for _ in range(integration):
-                    temp_monitor_frequency_mean = scan_frequencies(
-                        monitor_number_of_samples,
-                        interval_start,
-                        interval_end,
-                        interval_width,
-                        lna_gain,
-                        vga_gain,
-                        rx_amp,
-                        bias_tee,
-                        logger
-                    )
-                    for frequency in sorted(monitor_frequency_mean):
-                        monitor_frequency_mean[frequency] += temp_monitor_frequency_mean[frequency] - tuned_frequency_mean[frequency]
-
-                tuned_frequency_mean = interval_tuned_frequency_mean[interval_index]
-                for frequency in monitor_frequency_mean:
-                    if frequency not in tuned_frequency_mean:
-                        logger.error('Frequency {:,} not found in tuned frequencies.'.format(frequency))
-                    else:
-                        if monitor_frequency_mean[frequency] >= tuned_frequency_mean[frequency] + sensitivity:
-                            if not is_frequency_ignored(frequency, ignored_frequencies):
-                                max_frequency = frequency
-                                max_frequency_offset = monitor_frequency_mean[frequency] - tuned_frequency_mean[frequency]
-                                for freq in monitor_frequency_mean:
-                                    if not is_frequency_ignored(freq, ignored_frequencies):
-                                        frequency_offset = monitor_frequency_mean[freq] - tuned_frequency_mean[freq]
-                                        if frequency_offset > max_frequency_offset:
-                                            max_frequency = freq
-                                            max_frequency_offset = frequency_offset
-                                frequency = max_frequency
-                                logger.warning('{:,} Hz  ::  {:.2f} db > '
-                                               ' {:.2f} db + {:.2f} db'.format(
-                                    frequency,
-                                    monitor_frequency_mean[frequency],
-                                    tuned_frequency_mean[frequency],
-                                    sensitivity
-                                ))
-
-                                timestamp = datetime.today()
-
-                                file_name = '{}-{:03d}_{:03d}_{:03d}.pdf'.format(
-                                    timestamp.strftime('%H_%M_%S'),
-                                    int(frequency / 1_000_000),
-                                    int(frequency % 1_000_000 / 1_000),
-                                    int(frequency % 1_000)
-                                )
-                                file_path = os.path.join(dir_path, 'measurements', file_name)
-                                generate_graph(file_path, interval_start, interval_end, tuned_frequency_mean, monitor_frequency_mean, frequency, logger, ignored_frequencies)
-
-                                if update_krakensdr:
-                                    update_krakensdr_center_frequency(frequency / 1_000_000, krakensdr_config_file_path)
-
-                                ignored = False
-                            else:
-                                ignored = True
-
-                            # Store frequency measurement.
-                            with open(os.path.join(dir_path, 'measurements.csv'), 'a') as file:
-                                line = '{},{},{},{}\n'.format(
-                                    int(timestamp.timestamp()),
-                                    timestamp.strftime('%H:%M:%S'),
-                                    frequency,
-                                    int(ignored)
-                                )
-                                file.write(line)
-                            break
-                sleep(0.25)
-            end = time.time()
-            logger.debug("Interval: {:.2f}".format(end - start))
+    # The baseline is loaded from the previous run if possible, otherwise the radio frequencies are tuned once.
+    baseline = Baseline(intervals, config.get('baseline_alpha', 0.05))
+    baseline_file_path = config.get('baseline_file_path', os.path.join(home_dir, 'baseline.npz'))
+    tune_first = not baseline.load(baseline_file_path)
+    if not tune_first:
+        logger.info('Loaded the baseline from {}'.format(baseline_file_path))
+
+    # The metrics are served for Prometheus, or written to a file for the textfile collector of node_exporter.
+    if config.get('metrics_port'):
+        metrics_server = metrics.start_metrics_server(config.get('metrics_address', '127.0.0.1'), config['metrics_port'])
+        atexit.register(metrics_server.shutdown)
+    metrics_file_path = config.get('metrics_file_path')
+
+    if config.get('pipeline_enabled', False):
+        if not run_pipeline(config_file_path, config, intervals, baseline, baseline_file_path, tune_first, graphs_dir_path, logger, metrics_file_path):
+            sys.exit(1)
+        return
+
+    acquisition = Acquisition(config_cache, intervals, logger, tune_first)
+    processor = Processor(config_cache, intervals, baseline, baseline_file_path, logger)
+    sinks = Sinks(config_cache, intervals, graphs_dir_path, logger)
+
+    def process(message):
+        processor.process(message, sinks.handle, acquisition.update_activity)
+
+    # The stages are closed before the exit handlers, which shut down the executor of the graph workers.
+    try:
+        while True:
+            acquisition.run_cycle(process)
+            if metrics_file_path:
+                metrics.write_metrics(metrics_file_path)
+    finally:
+        # The emitters that are still active go to the sinks before they are closed.
+        acquisition.close()
+        processor.close(sinks.handle)
+        sinks.close()
 
 
 if __name__ == '__main__':